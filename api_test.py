@@ -1,4 +1,9 @@
 import requests
+from requests.adapters import HTTPAdapter
+
+# Reuse one keep-alive connection pool for all requests
+session = requests.Session()
+session.mount("http://", HTTPAdapter(pool_connections=32, pool_maxsize=32))
 
 url = "http://localhost:8000/webhook/whatsapp"
 payload = {
@@ -8,6 +13,5 @@ payload = {
     "timestamp": "2025-01-10T15:30:00Z",
     "customer_name": "Sumit Purbey"
 }
-resp = requests.post(url, json=payload)
+resp = session.post(url, json=payload)
 print(resp.json())
-
@@ -1,32 +1,121 @@
 # campaign_engine.py - New file for campaign logic
 
 from datetime import datetime, timedelta
-from sqlalchemy.orm import Session
-from typing import List, Dict, Optional
-import json
-import random
+from functools import lru_cache
+from sqlalchemy import String, and_, event, exists, literal, update
+from sqlalchemy.exc import IntegrityError
+from sqlalchemy.orm import Session, joinedload, object_session
+from typing import List, Dict, NamedTuple, Optional, Tuple
+import re
+import secrets
 import string
+import time
+import weakref
 from database import (
     Customer, CartItem, Campaign, CampaignSend, OfferCode,
-    Product, Message, get_database_session
+    Product, Message
 )
-from whatsapp_integration import WhatsAppService
+from whatsapp_integration import WhatsAppService, BATCH_SIZE
+from redis_manager import RedisManager
 import logging
 
 logger = logging.getLogger(__name__)
 
+# Attempts to insert offer codes before giving up on collisions
+OFFER_CODE_RETRIES = 3
+# Random offer code suffix: 4 chars of A-Z0-9 (36^4 codes per offer value)
+OFFER_CODE_ALPHABET = string.ascii_uppercase + string.digits
+OFFER_CODE_SUFFIX_LENGTH = 4
+
+# Active campaigns are cached for this long (seconds)
+CAMPAIGN_CACHE_TTL = 60
+CAMPAIGN_CACHE_KEY = "campaigns:cart_abandonment"
+# Carts older than this never get a campaign message; a campaign's first scan (before it has
+# a watermark) starts here, so carts already abandoned at deploy time are still picked up
+CAMPAIGN_MAX_CART_AGE = timedelta(hours=72)
+
+# Engines whose campaign cache is dropped when a campaign write commits - weak, so the
+# module-level listeners below don't keep discarded engines alive
+_campaign_engines = weakref.WeakSet()
+
+def _mark_campaigns_changed(mapper, connection, target) -> None:
+    session = object_session(target)
+    if session is not None:
+        session.info["campaigns_changed"] = True
+
+# Registered once at import: any ORM write to a campaign drops the cached lists on commit
+for _event_name in ("after_insert", "after_update", "after_delete"):
+    event.listen(Campaign, _event_name, _mark_campaigns_changed, propagate=True)
+
+@event.listens_for(Session, "after_commit")
+def _invalidate_campaign_caches(session: Session) -> None:
+    if session.info.pop("campaigns_changed", False):
+        for campaign_engine in list(_campaign_engines):
+            campaign_engine.invalidate_campaign_cache()
+
+@event.listens_for(Session, "after_rollback")
+def _forget_campaign_changes(session: Session) -> None:
+    session.info.pop("campaigns_changed", None)
+
+class CartScan(NamedTuple):
+    """Result of one abandoned-cart scan"""
+    ready_carts: List[Dict]
+    scanned_at: datetime
+    campaign_ids: List[str]
+
+class CampaignSnapshot(NamedTuple):
+    """Plain copy of the Campaign fields used while sending - safe to cache across sessions"""
+    id: str
+    name: str
+    trigger_delay_minutes: int
+    message_template: str
+    offer_type: Optional[str]
+    offer_value: Optional[float]
+    max_sends_per_customer: int
+
+_PLACEHOLDER_SPLIT_RE = re.compile(r"(\{\w+\})")
+
+class CompiledTemplate(NamedTuple):
+    """Template split into literal chunks, with the chunk positions of each placeholder"""
+    parts: Tuple[str, ...]
+    placeholders: Dict[str, Tuple[int, ...]]
+    
+    def render(self, values: Dict[str, str]) -> str:
+        """Fill in placeholders - ones without a value are left as-is"""
+        chunks = list(self.parts)
+        for name, positions in self.placeholders.items():
+            value = values.get(name)
+            if value is not None:
+                for i in positions:
+                    chunks[i] = value
+        return "".join(chunks)
+
+@lru_cache(maxsize=128)
+def compile_template(template: str) -> CompiledTemplate:
+    """Parse a campaign template once (cached - a handful of templates repeat every run)"""
+    parts = tuple(_PLACEHOLDER_SPLIT_RE.split(template))
+    placeholders: Dict[str, List[int]] = {}
+    # re.split with a capture group puts the "{name}" tokens at odd indices
+    for i in range(1, len(parts), 2):
+        placeholders.setdefault(parts[i][1:-1], []).append(i)
+    return CompiledTemplate(parts, {name: tuple(positions) for name, positions in placeholders.items()})
+
 class CampaignEngine:
     """
     Handles automated marketing campaigns for cart abandonment, upselling, etc.
     """
     
-    def __init__(self, whatsapp_service: WhatsAppService):
+    def __init__(self, whatsapp_service: WhatsAppService, redis_manager: Optional[RedisManager] = None):
         self.whatsapp_service = whatsapp_service
+        self.redis_manager = redis_manager
+        # (loaded_at, campaigns) - in-process fallback when there is no Redis to share the cache
+        self._campaign_cache: Optional[Tuple[float, List[CampaignSnapshot]]] = None
+        _campaign_engines.add(self)
     
     def generate_offer_code(self, campaign_name: str, offer_value: float) -> str:
-        """Generate unique offer code like CART10OFF"""
+        """Generate unique offer code like CART10X7Q9 - "CART", the offer value, 4 random A-Z0-9 chars"""
         prefix = "CART"
-        suffix = ''.join(random.choices(string.ascii_uppercase + string.digits, k=4))
+        suffix = "".join(secrets.choice(OFFER_CODE_ALPHABET) for _ in range(OFFER_CODE_SUFFIX_LENGTH))
         return f"{prefix}{int(offer_value)}{suffix}"
     
     def create_cart_abandonment_campaigns(self, db: Session) -> List[str]:
@@ -63,14 +152,16 @@ class CampaignEngine:
             }
         ]
         
+        # Check which campaigns already exist in one query
+        existing_names = {
+            name for (name,) in db.query(Campaign.name).filter(
+                Campaign.name.in_([campaign_data["name"] for campaign_data in campaigns])
+            ).all()
+        }
+        
         created_campaigns = []
         for campaign_data in campaigns:
-            # Check if campaign already exists
-            existing = db.query(Campaign).filter(
-                Campaign.name == campaign_data["name"]
-            ).first()
-            
-            if not existing:
+            if campaign_data["name"] not in existing_names:
                 campaign = Campaign(**campaign_data)
                 db.add(campaign)
                 created_campaigns.append(campaign_data["name"])
@@ -79,79 +170,175 @@ class CampaignEngine:
         logger.info(f"✅ Created {len(created_campaigns)} cart abandonment campaigns")
         return created_campaigns
     
-    def find_abandoned_carts_for_campaigns(self, db: Session) -> List[Dict]:
+    def get_active_campaigns(self, db: Session) -> List[CampaignSnapshot]:
+        """
+        Get active cart abandonment campaigns, cached in Redis (shared by all workers, so a
+        campaign write invalidates it everywhere) or in-process when Redis isn't available
+        """
+        if self.redis_manager:
+            cached = self.redis_manager.get_data(CAMPAIGN_CACHE_KEY)
+            if cached:
+                return [CampaignSnapshot(**c) for c in cached["campaigns"]]
+        elif self._campaign_cache:
+            loaded_at, campaigns = self._campaign_cache
+            if time.monotonic() - loaded_at < CAMPAIGN_CACHE_TTL:
+                return campaigns
+        
+        campaigns = [
+            CampaignSnapshot(
+                id=c.id,
+                name=c.name,
+                trigger_delay_minutes=c.trigger_delay_minutes,
+                message_template=c.message_template,
+                offer_type=c.offer_type,
+                offer_value=c.offer_value,
+                max_sends_per_customer=c.max_sends_per_customer
+            )
+            for c in db.query(Campaign).filter(
+                Campaign.is_active == True,
+                Campaign.campaign_type == "cart_abandonment"
+            ).all()
+        ]
+        if self.redis_manager:
+            self.redis_manager.set_data(
+                CAMPAIGN_CACHE_KEY,
+                {"campaigns": [c._asdict() for c in campaigns]},
+                CAMPAIGN_CACHE_TTL
+            )
+        else:
+            self._campaign_cache = (time.monotonic(), campaigns)
+        return campaigns
+    
+    def invalidate_campaign_cache(self) -> None:
+        """Drop cached campaigns so the next run reloads them"""
+        self._campaign_cache = None
+        if self.redis_manager:
+            self.redis_manager.delete_data(CAMPAIGN_CACHE_KEY)
+    
+    def find_abandoned_carts_for_campaigns(self, db: Session, cart_item_ids: Optional[List[str]] = None) -> List[Dict]:
         """
         Find abandoned carts that are ready for campaign messages
+        Pass cart_item_ids to check just those carts, regardless of the campaigns' watermarks
+        """
+        return self.scan_abandoned_carts(db, cart_item_ids).ready_carts
+    
+    def scan_abandoned_carts(self, db: Session, cart_item_ids: Optional[List[str]] = None) -> CartScan:
+        """
+        Find abandoned carts ready for campaign messages, plus what is needed to advance the
+        scanned campaigns' watermarks - that only happens once their sends are saved
+        
+        With cart_item_ids only those carts are checked (any age up to their trigger time) and
+        no watermark is reported, since the scan didn't cover the campaigns' windows
         """
         now = datetime.utcnow()
         ready_carts = []
         
         # Get all active campaigns
-        campaigns = db.query(Campaign).filter(
-            Campaign.is_active == True,
-            Campaign.campaign_type == "cart_abandonment"
-        ).all()
+        campaigns = self.get_active_campaigns(db)
         
-        for campaign in campaigns:
-            # Calculate when carts should trigger this campaign
-            trigger_time = now - timedelta(minutes=campaign.trigger_delay_minutes)
-            
-            # Find carts added around the trigger time (±5 minutes window)
-            window_start = trigger_time - timedelta(minutes=5)
-            window_end = trigger_time + timedelta(minutes=5)
-            
-            abandoned_carts = db.query(CartItem).filter(
-                CartItem.added_at >= window_start,
-                CartItem.added_at <= window_end,
-                CartItem.is_recovered == False
+        if not campaigns:
+            return CartScan(ready_carts, now, [])
+        
+        # Scan each campaign from its watermark up to its trigger time - no overlapping windows.
+        # Re-checking is_active here means a campaign deactivated outside the ORM (which the
+        # cache can't see) still stops sending at once
+        watermarks = dict(
+            db.query(Campaign.id, Campaign.last_scanned_at).filter(
+                Campaign.id.in_([campaign.id for campaign in campaigns]),
+                Campaign.is_active == True
             ).all()
-            
-            for cart in abandoned_carts:
-                # Check if we already sent this campaign to this customer
-                existing_send = db.query(CampaignSend).filter(
-                    CampaignSend.campaign_id == campaign.id,
-                    CampaignSend.customer_id == cart.customer_id,
-                    CampaignSend.cart_item_id == cart.id
-                ).first()
-                
-                if not existing_send and cart.campaign_sent_count < campaign.max_sends_per_customer:
-                    ready_carts.append({
-                        "cart": cart,
-                        "campaign": campaign,
-                        "customer": cart.customer,
-                        "product": cart.product
-                    })
-        
-        return ready_carts
+        )
+        campaigns = [campaign for campaign in campaigns if campaign.id in watermarks]
+        if not campaigns:
+            return CartScan(ready_carts, now, [])
+        
+        scans = []
+        for campaign in campaigns:
+            delay = timedelta(minutes=campaign.trigger_delay_minutes)
+            scan = db.query(literal(campaign.id, String), CartItem.id).filter(
+                CartItem.is_recovered == False,
+                CartItem.added_at <= now - delay,
+                CartItem.campaign_sent_count < campaign.max_sends_per_customer,
+                ~exists().where(and_(
+                    CampaignSend.cart_item_id == CartItem.id,
+                    CampaignSend.campaign_id == campaign.id
+                ))
+            )
+            if cart_item_ids is not None:
+                scan = scan.filter(CartItem.id.in_(cart_item_ids))
+            else:
+                # From the watermark, but never further back than the max cart age
+                window_start = now - CAMPAIGN_MAX_CART_AGE
+                last_scanned_at = watermarks.get(campaign.id)
+                if last_scanned_at:
+                    window_start = max(window_start, last_scanned_at - delay)
+                scan = scan.filter(CartItem.added_at > window_start)
+            scans.append(scan)
+        
+        # All campaign scans in one round-trip, only index-covered columns
+        matches = scans[0].union_all(*scans[1:]).all()
+        scanned_campaign_ids = [campaign.id for campaign in campaigns] if cart_item_ids is None else []
+        
+        if not matches:
+            return CartScan(ready_carts, now, scanned_campaign_ids)
+        
+        # Load full rows only for carts that will actually get a message
+        carts = {
+            cart.id: cart
+            for cart in db.query(CartItem).options(
+                joinedload(CartItem.customer),
+                joinedload(CartItem.product)
+            ).filter(CartItem.id.in_({cart_id for _, cart_id in matches})).all()
+        }
+        
+        campaigns_by_id = {campaign.id: campaign for campaign in campaigns}
+        for campaign_id, cart_id in matches:
+            cart = carts[cart_id]
+            campaign = campaigns_by_id[campaign_id]
+            ready_carts.append({
+                "cart": cart,
+                "campaign": campaign,
+                "customer": cart.customer,
+                "product": cart.product
+            })
+        
+        return CartScan(ready_carts, now, scanned_campaign_ids)
     
     def personalize_message(self, template: str, customer: Customer, cart: CartItem, 
                           product: Product, offer_code: str = None) -> str:
         """
         Personalize campaign message template with customer data
         """
-        customer_name = customer.first_name or "there"
+        compiled = compile_template(template)
+        placeholders = compiled.placeholders
+        if not placeholders:
+            return template
         
-        # Create product list text
-        product_list = f"• {product.name} (${product.price})"
-        if cart.quantity > 1:
-            product_list += f" x{cart.quantity}"
+        # Only build the values this template actually uses
+        values = {}
+        if "customer_name" in placeholders:
+            values["customer_name"] = customer.first_name or "there"
         
-        # Create cart link (placeholder for now)
-        cart_link = f"https://yourstore.com/cart?recover={cart.id}"
+        if "product_list" in placeholders:
+            # Create product list text
+            product_list = f"• {product.name} (${product.price})"
+            if cart.quantity > 1:
+                product_list += f" x{cart.quantity}"
+            values["product_list"] = product_list
         
-        # Replace template variables
-        message = template.replace("{customer_name}", customer_name)
-        message = message.replace("{product_list}", product_list)
-        message = message.replace("{cart_link}", cart_link)
+        if "cart_link" in placeholders:
+            # Create cart link (placeholder for now)
+            values["cart_link"] = f"https://yourstore.com/cart?recover={cart.id}"
         
-        if offer_code:
-            message = message.replace("{offer_code}", offer_code)
+        if offer_code and "offer_code" in placeholders:
+            values["offer_code"] = offer_code
         
-        return message
+        # Splice values into the pre-split template
+        return compiled.render(values)
     
-    def create_offer_code(self, db: Session, campaign: Campaign) -> Optional[str]:
+    def build_offer_code(self, campaign: Campaign) -> Optional[OfferCode]:
         """
-        Create unique offer code for campaign
+        Build (unsaved) unique offer code record for campaign
         """
         if not campaign.offer_type or campaign.offer_type == "free_shipping":
             return None
@@ -159,8 +346,7 @@ class CampaignEngine:
         # Generate unique code
         code = self.generate_offer_code(campaign.name, campaign.offer_value)
         
-        # Create offer code record
-        offer = OfferCode(
+        return OfferCode(
             code=code,
             offer_type=campaign.offer_type,
             offer_value=campaign.offer_value,
@@ -168,86 +354,209 @@ class CampaignEngine:
             expires_at=datetime.utcnow() + timedelta(hours=24),
             campaign_id=campaign.id
         )
+    
+    def create_offer_code(self, db: Session, campaign: Campaign) -> Optional[str]:
+        """
+        Create unique offer code for campaign (flushed - committed along with the send)
+        """
+        for attempt in range(OFFER_CODE_RETRIES):
+            offer = self.build_offer_code(campaign)
+            if not offer:
+                return None
+            
+            try:
+                # Savepoint + flush so the caller's loaded rows aren't expired by a commit
+                with db.begin_nested():
+                    db.add(offer)
+                return offer.code
+            except IntegrityError:
+                # Code collided with an existing one - try a fresh code
+                logger.warning(f"Offer code collision, retrying ({attempt + 1}/{OFFER_CODE_RETRIES})")
         
-        db.add(offer)
-        db.commit()
+        raise RuntimeError("Could not generate a unique offer code")
+    
+    def create_offer_codes(self, db: Session, ready_carts: List[Dict]) -> None:
+        """
+        Create offer codes for a batch of carts with a single flush
+        Stores the code on each cart_data dict under "offer_code" - the caller commits
+        """
+        for attempt in range(OFFER_CODE_RETRIES):
+            offers = []
+            for cart_data in ready_carts:
+                offer = self.build_offer_code(cart_data["campaign"])
+                cart_data["offer_code"] = offer.code if offer else None
+                if offer:
+                    offers.append(offer)
+            
+            if not offers:
+                return
+            
+            try:
+                # Flush inside a savepoint instead of committing: a commit would expire the
+                # carts/customers/products loaded for this run and reload them row by row.
+                # The codes are committed together with the campaign sends
+                with db.begin_nested():
+                    db.add_all(offers)
+                return
+            except IntegrityError:
+                # A code collided - only the savepoint is rolled back, regenerate the whole batch
+                logger.warning(f"Offer code collision, retrying ({attempt + 1}/{OFFER_CODE_RETRIES})")
         
-        return code
+        # The batch kept colliding - leave each cart to create its own code while its
+        # message is prepared, so an exhausted code only fails that one cart
+        logger.warning("Could not allocate offer codes as a batch, falling back to per-cart codes")
+        for cart_data in ready_carts:
+            cart_data.pop("offer_code", None)
     
-    def send_campaign_message(self, db: Session, cart_data: Dict) -> Dict:
+    def prepare_campaign_message(self, db: Session, cart_data: Dict) -> Dict:
         """
-        Send a single campaign message to customer
+        Prepare a campaign message (offer code + personalized text) without sending
+        Runs on the caller's thread since it may touch the database session
         """
         cart = cart_data["cart"]
         campaign = cart_data["campaign"]
         customer = cart_data["customer"]
         product = cart_data["product"]
         
-        try:
-            # Create offer code if needed
-            offer_code = None
-            if campaign.offer_type and campaign.offer_type != "free_shipping":
-                offer_code = self.create_offer_code(db, campaign)
-            
-            # Personalize message
-            message_content = self.personalize_message(
-                campaign.message_template, customer, cart, product, offer_code
+        # Create offer code if needed (unless pre-allocated for the batch)
+        if "offer_code" in cart_data:
+            offer_code = cart_data["offer_code"]
+        else:
+            offer_code = self.create_offer_code(db, campaign)
+        
+        # Personalize message
+        message_content = self.personalize_message(
+            campaign.message_template, customer, cart, product, offer_code
+        )
+        
+        return {
+            **cart_data,
+            "offer_code": offer_code,
+            "message_content": message_content,
+            "to_phone": customer.whatsapp_phone
+        }
+    
+    def transmit_campaign_message(self, prepared: Dict) -> Optional[Dict]:
+        """
+        Send a prepared campaign message over WhatsApp
+        Only uses plain values from `prepared`, so it is safe to run in worker threads
+        """
+        if not prepared["to_phone"] or not self.whatsapp_service:
+            return None
+        
+        return self.whatsapp_service.send_message(
+            prepared["to_phone"], prepared["message_content"]
+        )
+    
+    def build_campaign_send(self, prepared: Dict, whatsapp_result: Optional[Dict]) -> Tuple[Dict, List]:
+        """
+        Build (unsaved) campaign send + message records for a transmitted message
+        
+        Returns:
+            Tuple[Dict, List]: (result, records) - records is empty unless sent
+        """
+        if whatsapp_result and whatsapp_result['status'] == 'error':
+            return whatsapp_result, []
+        if whatsapp_result and whatsapp_result['status'] == 'failed':
+            return {"status": "failed", "reason": whatsapp_result.get('error'), "cart_item_id": prepared["cart"].id}, []
+        if not whatsapp_result or whatsapp_result['status'] != 'sent':
+            return {"status": "failed", "reason": "No WhatsApp number or service unavailable"}, []
+        
+        cart = prepared["cart"]
+        campaign = prepared["campaign"]
+        customer = prepared["customer"]
+        offer_code = prepared["offer_code"]
+        message_content = prepared["message_content"]
+        sent_at = datetime.utcnow()
+        
+        # Create campaign send record
+        campaign_send = CampaignSend(
+            campaign_id=campaign.id,
+            customer_id=customer.id,
+            cart_item_id=cart.id,
+            message_content=message_content,
+            offer_code_used=offer_code,
+            whatsapp_message_id=whatsapp_result['message_id'],
+            sent_at=sent_at
+        )
+        
+        # Save WhatsApp message to messages table
+        message_record = Message(
+            customer_id=customer.id,
+            channel="whatsapp",
+            direction="outbound",
+            content=message_content,
+            platform_message_id=whatsapp_result['message_id'],
+            sent_at=sent_at,
+            bot_handled=True,
+            metadata_json={
+                "campaign_id": campaign.id,
+                "campaign_type": "cart_abandonment",
+                "offer_code": offer_code,
+                "cart_item_id": cart.id
+            }
+        )
+        
+        logger.info(f"✅ Sent cart abandonment campaign '{campaign.name}' to {customer.first_name}")
+        
+        result = {
+            "status": "sent",
+            "campaign": campaign.name,
+            "customer": customer.first_name,
+            "offer_code": offer_code,
+            "message_id": whatsapp_result['message_id'],
+            "cart_item_id": cart.id
+        }
+        return result, [campaign_send, message_record]
+    
+    def save_campaign_sends(self, db: Session, records: List, cart_item_ids: List[str],
+                            watermarks: Optional[Dict[str, datetime]] = None) -> None:
+        """
+        Bulk-insert send/message records and bump cart tracking in one commit
+        Also commits anything already flushed for the run (e.g. the batch's offer codes), and
+        moves each campaign in `watermarks` (campaign_id -> last_scanned_at) in the same transaction
+        """
+        # One UPDATE per distinct watermark - usually every campaign shares the scan time
+        campaign_ids_by_watermark: Dict[datetime, List[str]] = {}
+        for campaign_id, last_scanned_at in (watermarks or {}).items():
+            campaign_ids_by_watermark.setdefault(last_scanned_at, []).append(campaign_id)
+        for last_scanned_at, campaign_ids in campaign_ids_by_watermark.items():
+            db.execute(
+                update(Campaign)
+                .where(Campaign.id.in_(campaign_ids))
+                .values(last_scanned_at=last_scanned_at)
+                .execution_options(synchronize_session=False)
             )
+        
+        if records:
+            db.bulk_save_objects(records)
             
-            # Send WhatsApp message
-            if customer.whatsapp_phone and self.whatsapp_service:
-                whatsapp_result = self.whatsapp_service.send_message(
-                    customer.whatsapp_phone, message_content
+            # Update cart tracking with a single UPDATE
+            db.execute(
+                update(CartItem)
+                .where(CartItem.id.in_(cart_item_ids))
+                .values(
+                    campaign_sent_count=CartItem.campaign_sent_count + 1,
+                    last_campaign_sent=datetime.utcnow()
                 )
-                
-                if whatsapp_result['status'] == 'sent':
-                    # Create campaign send record
-                    campaign_send = CampaignSend(
-                        campaign_id=campaign.id,
-                        customer_id=customer.id,
-                        cart_item_id=cart.id,
-                        message_content=message_content,
-                        offer_code_used=offer_code,
-                        whatsapp_message_id=whatsapp_result['message_id'],
-                        sent_at=datetime.utcnow()
-                    )
-                    db.add(campaign_send)
-                    
-                    # Update cart tracking
-                    cart.campaign_sent_count += 1
-                    cart.last_campaign_sent = datetime.utcnow()
-                    
-                    # Save WhatsApp message to messages table
-                    message_record = Message(
-                        customer_id=customer.id,
-                        channel="whatsapp",
-                        direction="outbound",
-                        content=message_content,
-                        platform_message_id=whatsapp_result['message_id'],
-                        sent_at=datetime.utcnow(),
-                        bot_handled=True,
-                        metadata_json=json.dumps({
-                            "campaign_id": campaign.id,
-                            "campaign_type": "cart_abandonment",
-                            "offer_code": offer_code,
-                            "cart_item_id": cart.id
-                        })
-                    )
-                    db.add(message_record)
-                    
-                    db.commit()
-                    
-                    logger.info(f"✅ Sent cart abandonment campaign '{campaign.name}' to {customer.first_name}")
-                    
-                    return {
-                        "status": "sent",
-                        "campaign": campaign.name,
-                        "customer": customer.first_name,
-                        "offer_code": offer_code,
-                        "message_id": whatsapp_result['message_id']
-                    }
+                .execution_options(synchronize_session=False)
+            )
+        
+        db.commit()
+    
+    def send_campaign_message(self, db: Session, cart_data: Dict) -> Dict:
+        """
+        Send a single campaign message to customer
+        """
+        try:
+            prepared = self.prepare_campaign_message(db, cart_data)
+            whatsapp_result = self.transmit_campaign_message(prepared)
+            result, records = self.build_campaign_send(prepared, whatsapp_result)
+            
+            if records:
+                self.save_campaign_sends(db, records, [result["cart_item_id"]])
             
-            return {"status": "failed", "reason": "No WhatsApp number or service unavailable"}
+            return result
             
         except Exception as e:
             logger.error(f"❌ Failed to send campaign message: {e}")
@@ -260,28 +569,92 @@ class CampaignEngine:
         logger.info("🚀 Running cart abandonment campaigns...")
         
         # Find carts ready for campaigns
-        ready_carts = self.find_abandoned_carts_for_campaigns(db)
+        scan = self.scan_abandoned_carts(db)
+        ready_carts = scan.ready_carts
+        
+        # Next run starts where this one stopped...
+        watermarks = dict.fromkeys(scan.campaign_ids, scan.scanned_at)
+        
+        def hold_watermark(cart_data: Dict) -> None:
+            """...except that a campaign's watermark stays low enough to rescan this cart"""
+            campaign = cart_data["campaign"]
+            if campaign.id in watermarks:
+                # Scans take carts added after (watermark - delay)
+                cart_watermark = (
+                    cart_data["cart"].added_at
+                    + timedelta(minutes=campaign.trigger_delay_minutes)
+                    - timedelta(microseconds=1)
+                )
+                watermarks[campaign.id] = min(watermarks[campaign.id], cart_watermark)
         
         if not ready_carts:
+            self.save_campaign_sends(db, [], [], watermarks)
             return {
                 "status": "completed",
                 "messages_sent": 0,
                 "message": "No abandoned carts ready for campaigns"
             }
         
-        # Send campaign messages
-        sent_count = 0
-        failed_count = 0
-        results = []
+        # Allocate all offer codes up front with one flush (committed with the sends below)
+        self.create_offer_codes(db, ready_carts)
         
+        # Prepare messages on this thread (database session is not thread-safe)
+        # A cart that couldn't be sent holds its campaign's watermark just below itself, so the
+        # next run retries it (carts already sent are excluded by their CampaignSend). A cart
+        # that keeps failing stops holding it once it ages past CAMPAIGN_MAX_CART_AGE
+        prepared_messages = []
+        results = []
         for cart_data in ready_carts:
-            result = self.send_campaign_message(db, cart_data)
+            try:
+                prepared_messages.append(self.prepare_campaign_message(db, cart_data))
+            except Exception as e:
+                # e.g. no unique offer code - skip just this cart
+                logger.error(f"❌ Failed to prepare campaign message: {e}")
+                results.append({"status": "error", "error": str(e), "cart_item_id": cart_data["cart"].id})
+                hold_watermark(cart_data)
+        
+        # Send in per-campaign batches; messages differ only by their parameters
+        whatsapp_results = [None] * len(prepared_messages)
+        batches = {}
+        for index, prepared in enumerate(prepared_messages):
+            if prepared["to_phone"] and self.whatsapp_service:
+                batches.setdefault(prepared["campaign"].id, []).append(index)
+        
+        for indexes in batches.values():
+            for offset in range(0, len(indexes), BATCH_SIZE):
+                batch = indexes[offset:offset + BATCH_SIZE]
+                try:
+                    batch_results = self.whatsapp_service.send_batch([
+                        {"to": prepared_messages[i]["to_phone"], "body": prepared_messages[i]["message_content"]}
+                        for i in batch
+                    ])
+                except Exception as e:
+                    logger.error(f"❌ Campaign batch send failed: {e}")
+                    break
+                # Failed sends are only recorded, not re-sent here: an immediate retry would
+                # bypass the rate limiter, and a send that timed out after Twilio accepted it
+                # would reach the customer twice. The next run picks the cart up again
+                for i, whatsapp_result in zip(batch, batch_results):
+                    whatsapp_results[i] = whatsapp_result
+        
+        # Record all sends with one bulk insert + commit
+        records = []
+        sent_cart_ids = []
+        for prepared, whatsapp_result in zip(prepared_messages, whatsapp_results):
+            result, send_records = self.build_campaign_send(prepared, whatsapp_result)
             results.append(result)
-            
-            if result["status"] == "sent":
-                sent_count += 1
-            else:
-                failed_count += 1
+            if send_records:
+                records.extend(send_records)
+                sent_cart_ids.append(result["cart_item_id"])
+            elif prepared["to_phone"]:
+                # Had a number but wasn't sent (send failed, batch aborted, no service)
+                hold_watermark(prepared)
+        
+        # Sends, offer codes and watermarks commit together
+        self.save_campaign_sends(db, records, sent_cart_ids, watermarks)
+        
+        sent_count = sum(1 for result in results if result["status"] == "sent")
+        failed_count = len(results) - sent_count
         
         logger.info(f"📊 Campaign results: {sent_count} sent, {failed_count} failed")
         
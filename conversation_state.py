@@ -2,12 +2,35 @@
 
 import uuid
 import logging
-from typing import Optional, Dict, Any
+from functools import lru_cache
+from typing import Optional, Dict, Any, Callable, Tuple
 from datetime import datetime
 from redis_manager import RedisManager
 
 logger = logging.getLogger(__name__)
 
+@lru_cache(maxsize=256)
+def _split_key_path(key_path: str) -> Tuple[str, ...]:
+    """Split a dotted key like "metadata.message_count" (cached - keys repeat every turn)"""
+    return tuple(key_path.split("."))
+
+def apply_state_updates(state: Dict[str, Any], updates: Dict[str, Any]) -> None:
+    """
+    Apply updates to a state dict in place
+    Keys may be top-level ("current_step") or dotted paths ("metadata.message_count")
+    """
+    for key_path, value in updates.items():
+        if "." in key_path:
+            # Handle nested keys like "metadata.message_count"
+            *parents, last = _split_key_path(key_path)
+            target = state
+            for part in parents:
+                target = target.setdefault(part, {})
+            target[last] = value
+        else:
+            # Handle top-level keys
+            state[key_path] = value
+
 class ConversationState:
     """
     Manages conversation state for individual customers
@@ -35,12 +58,48 @@ class ConversationState:
         Returns:
             str: Redis key (e.g., "conversation:cust_123")
         """
-        return f"conversation:{customer_id}"
+        return "conversation:" + customer_id
+    
+    def get_activity_key(self, customer_id: str) -> str:
+        """
+        Generate Redis key for the customer's last activity timestamp
+        Kept outside the "conversation:*" namespace so it never shows up as a session
+        
+        Args:
+            customer_id: Unique customer identifier
+            
+        Returns:
+            str: Redis key (e.g., "conversation_activity:cust_123")
+        """
+        return "conversation_activity:" + customer_id
     
     def create_new_session(self, customer_id: str) -> Dict[str, Any]:
         """
         Create new conversation session for customer
         
+        Args:
+            customer_id: Customer identifier
+            
+        Returns:
+            Dict: New conversation state
+        """
+        new_state = self._build_new_state(customer_id)
+        
+        # Store in Redis
+        key = self.get_conversation_key(customer_id)
+        success = self.redis.set_data(key, new_state, self.session_timeout)
+        
+        if success:
+            logger.info("Created new conversation session: %s -> %s", customer_id, new_state['session_id'])
+        else:
+            logger.error("Failed to create conversation session for %s", customer_id)
+        
+        return new_state
+    
+    def _build_new_state(self, customer_id: str) -> Dict[str, Any]:
+        """
+        Build a fresh conversation state without saving it
+        
         Args:
             customer_id: Customer identifier
             
@@ -48,8 +107,9 @@ class ConversationState:
             Dict: New conversation state
         """
         session_id = f"sess_{uuid.uuid4().hex[:12]}"
+        now = datetime.now().isoformat()
         
-        new_state = {
+        return {
             "customer_id": customer_id,
             "session_id": session_id,
             "current_flow": None,           # No active flow initially
@@ -57,24 +117,13 @@ class ConversationState:
             "collected_data": {},           # Data collected during flow
             "flow_history": [],             # Track completed flows
             "metadata": {
-                "created_at": datetime.now().isoformat(),
-                "last_activity": datetime.now().isoformat(),
+                "created_at": now,
+                "last_activity": now,
                 "message_count": 0,
                 "total_flows_started": 0,
                 "total_flows_completed": 0
             }
         }
-        
-        # Store in Redis
-        key = self.get_conversation_key(customer_id)
-        success = self.redis.set_data(key, new_state, self.session_timeout)
-        
-        if success:
-            logger.info(f"Created new conversation session: {customer_id} -> {session_id}")
-        else:
-            logger.error(f"Failed to create conversation session for {customer_id}")
-        
-        return new_state
     
     def get_state(self, customer_id: str) -> Optional[Dict[str, Any]]:
         """
@@ -87,19 +136,34 @@ class ConversationState:
             Dict: Current state or None if no active session
         """
         key = self.get_conversation_key(customer_id)
-        state = self.redis.get_data(key)
+        now = datetime.now().isoformat()
+        # Read, refresh the session TTL and record activity in one round-trip.
+        # last_activity goes to a small sidecar key - the state blob is only rewritten on updates
+        state = self.redis.get_data_and_refresh(
+            key, self.session_timeout, touch={self.get_activity_key(customer_id): now}
+        )
         
         if state:
             # Update last activity time
-            state["metadata"]["last_activity"] = datetime.now().isoformat()
-            # Save updated state back to Redis
-            self.redis.set_data(key, state, self.session_timeout)
-            logger.debug(f"Retrieved conversation state for {customer_id}")
+            state["metadata"]["last_activity"] = now
+            logger.debug("Retrieved conversation state for %s", customer_id)
         else:
-            logger.debug(f"No active conversation state for {customer_id}")
+            logger.debug("No active conversation state for %s", customer_id)
         
         return state
     
+    def get_last_activity(self, customer_id: str) -> Optional[str]:
+        """
+        Get the customer's last activity time (including reads that didn't rewrite the state)
+        
+        Args:
+            customer_id: Customer identifier
+            
+        Returns:
+            str: ISO timestamp or None if no active session
+        """
+        return self.redis.get_data(self.get_activity_key(customer_id))
+    
     def update_state(self, customer_id: str, updates: Dict[str, Any]) -> bool:
         """
         Update conversation state for customer
@@ -111,41 +175,128 @@ class ConversationState:
         Returns:
             bool: True if updated successfully
         """
+        return self._modify_state(customer_id, lambda state: apply_state_updates(state, updates)) is not None
+    
+    def update_and_get(self, customer_id: str, updates: Dict[str, Any]) -> Optional[Dict[str, Any]]:
+        """
+        Update conversation state and return the saved state, without reading it back
+        
+        Args:
+            customer_id: Customer identifier
+            updates: Dictionary of updates to apply
+            
+        Returns:
+            Dict: Updated state or None if there is no active session / the write failed
+        """
+        return self._modify_state(customer_id, lambda state: apply_state_updates(state, updates))
+    
+    def set_current_step(self, customer_id: str, step: str) -> bool:
+        """
+        Set the current flow step
+        
+        Args:
+            customer_id: Customer identifier
+            step: Step name
+            
+        Returns:
+            bool: True if updated successfully
+        """
+        def mutate(state: Dict[str, Any]) -> None:
+            state["current_step"] = step
+        
+        return self._modify_state(customer_id, mutate) is not None
+    
+    def incr_message_count(self, customer_id: str, amount: int = 1) -> bool:
+        """
+        Increment the conversation message counter
+        
+        Args:
+            customer_id: Customer identifier
+            amount: Amount to add
+            
+        Returns:
+            bool: True if updated successfully
+        """
+        def mutate(state: Dict[str, Any]) -> None:
+            metadata = state.setdefault("metadata", {})
+            metadata["message_count"] = metadata.get("message_count", 0) + amount
+        
+        return self._modify_state(customer_id, mutate) is not None
+    
+    def _modify_state(self, customer_id: str, mutate: Callable[[Dict[str, Any]], None],
+                      create_if_missing: bool = False) -> Optional[Dict[str, Any]]:
+        """
+        Read state, apply `mutate` to it in place and save it back
+        
+        Args:
+            customer_id: Customer identifier
+            mutate: Function that changes the state dict in place
+            create_if_missing: Start a new session if none exists instead of failing
+            
+        Returns:
+            Dict: The saved state, or None if there was no session / the write failed
+        """
         key = self.get_conversation_key(customer_id)
-        current_state = self.redis.get_data(key)
+        # Read state and refresh its TTL in a single round-trip
+        current_state = self.redis.get_data_and_refresh(key, self.session_timeout)
         
         if not current_state:
-            logger.warning(f"Cannot update state - no active session for {customer_id}")
-            return False
+            if not create_if_missing:
+                logger.warning("Cannot update state - no active session for %s", customer_id)
+                return None
+            # New session is written together with the update below
+            current_state = self._build_new_state(customer_id)
+            logger.info("Created new conversation session: %s -> %s", customer_id, current_state['session_id'])
         
         # Apply updates
-        for key_path, value in updates.items():
-            if "." in key_path:
-                # Handle nested keys like "metadata.message_count"
-                parts = key_path.split(".")
-                target = current_state
-                for part in parts[:-1]:
-                    if part not in target:
-                        target[part] = {}
-                    target = target[part]
-                target[parts[-1]] = value
-            else:
-                # Handle top-level keys
-                current_state[key_path] = value
+        mutate(current_state)
         
+        return self._save_state(customer_id, current_state)
+    
+    def apply_and_save(self, customer_id: str, state: Dict[str, Any],
+                       updates: Dict[str, Any]) -> Optional[Dict[str, Any]]:
+        """
+        Apply updates to a state the caller already holds (from get_state this turn) and
+        save it, skipping the read that update_state would do
+        
+        Args:
+            customer_id: Customer identifier
+            state: Current state, updated in place
+            updates: Dictionary of updates to apply
+            
+        Returns:
+            Dict: The saved state, or None if the write failed
+        """
+        apply_state_updates(state, updates)
+        return self._save_state(customer_id, state)
+    
+    def _save_state(self, customer_id: str, state: Dict[str, Any]) -> Optional[Dict[str, Any]]:
+        """
+        Stamp last activity and write the state (with its activity key) in one round-trip
+        
+        Args:
+            customer_id: Customer identifier
+            state: State to save
+            
+        Returns:
+            Dict: The saved state, or None if the write failed
+        """
         # Always update last activity
-        current_state["metadata"]["last_activity"] = datetime.now().isoformat()
+        now = datetime.now().isoformat()
+        state["metadata"]["last_activity"] = now
         
-        # Save back to Redis
-        redis_key = self.get_conversation_key(customer_id)
-        success = self.redis.set_data(redis_key, current_state, self.session_timeout)
+        # Save back to Redis, with the activity key, in one round-trip
+        success = self.redis.set_many(
+            {self.get_conversation_key(customer_id): state, self.get_activity_key(customer_id): now},
+            self.session_timeout
+        )
         
-        if success:
-            logger.debug(f"Updated conversation state for {customer_id}")
-        else:
-            logger.error(f"Failed to update conversation state for {customer_id}")
+        if not success:
+            logger.error("Failed to update conversation state for %s", customer_id)
+            return None
         
-        return success
+        logger.debug("Updated conversation state for %s", customer_id)
+        return state
     
     def start_flow(self, customer_id: str, flow_name: str) -> bool:
         """
@@ -158,26 +309,18 @@ class ConversationState:
         Returns:
             bool: True if flow started successfully
         """
-        updates = {
-            "current_flow": flow_name,
-            "current_step": "flow_started",
-            "collected_data": {},  # Reset data for new flow
-            "metadata.total_flows_started": None  # Will be incremented below
-        }
+        def mutate(state: Dict[str, Any]) -> None:
+            state["current_flow"] = flow_name
+            state["current_step"] = "flow_started"
+            state["collected_data"] = {}  # Reset data for new flow
+            metadata = state.setdefault("metadata", {})
+            metadata["total_flows_started"] = metadata.get("total_flows_started", 0) + 1
         
-        # Get current state to increment counter
-        current_state = self.get_state(customer_id)
-        if current_state:
-            updates["metadata.total_flows_started"] = current_state["metadata"]["total_flows_started"] + 1
-        else:
-            # Create new session if none exists
-            self.create_new_session(customer_id)
-            updates["metadata.total_flows_started"] = 1
-        
-        success = self.update_state(customer_id, updates)
+        # Increment the counter in the same read-modify-write (creates the session if none exists)
+        success = self._modify_state(customer_id, mutate, create_if_missing=True) is not None
         
         if success:
-            logger.info(f"Started flow '{flow_name}' for customer {customer_id}")
+            logger.info("Started flow '%s' for customer %s", flow_name, customer_id)
         
         return success
     
@@ -194,7 +337,7 @@ class ConversationState:
         """
         current_state = self.get_state(customer_id)
         if not current_state or not current_state.get("current_flow"):
-            logger.warning(f"Cannot complete flow - no active flow for {customer_id}")
+            logger.warning("Cannot complete flow - no active flow for %s", customer_id)
             return False
         
         # Add to flow history
@@ -219,7 +362,7 @@ class ConversationState:
         success = self.update_state(customer_id, updates)
         
         if success:
-            logger.info(f"Completed flow for customer {customer_id} with outcome: {outcome}")
+            logger.info("Completed flow for customer %s with outcome: %s", customer_id, outcome)
         
         return success
     
@@ -235,9 +378,10 @@ class ConversationState:
         """
         key = self.get_conversation_key(customer_id)
         success = self.redis.delete_data(key)
+        self.redis.delete_data(self.get_activity_key(customer_id))
         
         if success:
-            logger.info(f"Cleared conversation session for {customer_id}")
+            logger.info("Cleared conversation session for %s", customer_id)
         
         return success
     
@@ -251,8 +395,7 @@ class ConversationState:
         Returns:
             bool: True if active session exists
         """
-        key = self.get_conversation_key(customer_id)
-        return self.redis.get_data(key) is not None
+        return self.redis.exists(self.get_conversation_key(customer_id))
     
     def get_or_create_state(self, customer_id: str) -> Dict[str, Any]:
         """
@@ -0,0 +1,45 @@
+# intents.py - Keyword intent detection for free-text WhatsApp messages
+
+import re
+from typing import Iterator, Optional
+
+_WORD_RE = re.compile(r"[a-z]+")
+
+# Intent keywords are stems: a keyword matches any word starting with it ("refund" ->
+# "refunded", "info" -> "information"), like the old substring checks did. Keywords
+# shorter than MIN_STEM_LENGTH only match whole words, so "hi" doesn't match "his"/"history"
+MIN_STEM_LENGTH = 3
+GREETING_KW = frozenset({"hi", "hello", "hey", "menu", "start", "help"})
+ORDER_KW = frozenset({"order", "status", "track", "shipping", "shipped"})
+PRODUCT_KW = frozenset({"product", "catalog", "buy", "shop", "price"})
+ACCOUNT_KW = frozenset({"account", "profile", "info", "detail"})
+RETURN_KW = frozenset({"return", "refund", "exchange", "cancel"})
+THANK_KW = frozenset({"thank", "appreciate"})
+
+# One keyword -> intent table, so a message is scanned once; when several intents match,
+# the lowest rank wins, which keeps the old if/elif precedence
+INTENTS = ("greeting", "orders", "products", "account", "returns", "thanks")
+KEYWORD_INTENTS = {
+    keyword: rank
+    for rank, keywords in enumerate((GREETING_KW, ORDER_KW, PRODUCT_KW, ACCOUNT_KW, RETURN_KW, THANK_KW))
+    for keyword in keywords
+}
+
+def keyword_ranks(word: str) -> Iterator[int]:
+    """
+    Ranks of every keyword the word is, or starts with (for keywords of MIN_STEM_LENGTH or more)
+    """
+    rank = KEYWORD_INTENTS.get(word)
+    if rank is not None:
+        yield rank
+    for length in range(MIN_STEM_LENGTH, len(word)):
+        rank = KEYWORD_INTENTS.get(word[:length])
+        if rank is not None:
+            yield rank
+
+def detect_intent(text: str) -> Optional[str]:
+    """
+    Map a lowercased message to its highest-priority intent (None if no keyword matches)
+    """
+    ranks = [rank for word in _WORD_RE.findall(text) for rank in keyword_ranks(word)]
+    return INTENTS[min(ranks)] if ranks else None
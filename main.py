@@ -2,20 +2,27 @@
 Complete E-commerce Automation API with Real WhatsApp Integration and Dashboard
 """
 
-from fastapi import FastAPI, HTTPException, Depends, Form, Request
-from fastapi.responses import HTMLResponse, PlainTextResponse
-from sqlalchemy.orm import Session
+from fastapi import FastAPI, HTTPException, Depends, Form, Request, BackgroundTasks
+from fastapi.concurrency import run_in_threadpool
+from fastapi.responses import HTMLResponse, PlainTextResponse, Response, StreamingResponse
+from sqlalchemy import func, insert, or_, select, tuple_, update
+from sqlalchemy.dialects.postgresql import insert as pg_insert
+from sqlalchemy.orm import Session, joinedload
 from pydantic import BaseModel
 from datetime import datetime, timedelta
 from typing import Optional, List, Dict, Any
 from contextlib import asynccontextmanager
-import json
+import base64
+import csv
+import hashlib
+import io
 import logging
 import os
+import uuid
 
 # Import our database models and functions
 from database import (
-    get_database_session, create_tables,
+    get_database_session, create_tables, upgrade_schema,
     Customer, Order, Message, WebhookEvent,
     find_or_create_customer,
     Product, CartItem, Campaign, CampaignSend
@@ -27,6 +34,7 @@ from campaign_engine import CampaignEngine
 from redis_manager import RedisManager
 from conversation_state import ConversationState
 from support_flow import SupportFlow
+from intents import detect_intent
 
 # Configure logging
 logging.basicConfig(level=logging.INFO)
@@ -38,15 +46,87 @@ campaign_engine = None
 redis_manager = None
 conversation_manager = None
 support_flow_handler = None
+dashboard_html = None
+dashboard_etag = None
+
+# Browsers may reuse the dashboard page for a few minutes, then revalidate with If-None-Match
+DASHBOARD_CACHE_CONTROL = "public, max-age=300, must-revalidate"
+
+def load_dashboard_html() -> Optional[str]:
+    """
+    Read the dashboard page from disk (None if it doesn't exist)
+    """
+    try:
+        with open("templates/dashboard.html", "r", encoding="utf-8") as file:
+            return file.read()
+    except FileNotFoundError:
+        return None
+
+def parse_webhook_timestamp(value: str) -> datetime:
+    """
+    Parse an ISO-8601 webhook timestamp, including a trailing "Z" (which fromisoformat rejects before Python 3.11)
+    """
+    if value.endswith("Z"):
+        value = value[:-1] + "+00:00"
+    return datetime.fromisoformat(value)
+
+def parse_uuid(value: str) -> Optional[str]:
+    """
+    Canonical form of an id taken from a URL/cursor, or None if it isn't a UUID
+    Ids are native UUID columns, so a malformed one would make PostgreSQL raise instead of matching nothing
+    """
+    try:
+        return str(uuid.UUID(value))
+    except (TypeError, ValueError):
+        return None
+
+def encode_page_cursor(created_at: datetime, row_id: str) -> str:
+    """
+    Opaque keyset cursor for newest-first listings: the last row's (created_at, id)
+    """
+    return base64.urlsafe_b64encode(f"{created_at.isoformat()}|{row_id}".encode()).decode()
+
+def decode_page_cursor(cursor: str):
+    """
+    Inverse of encode_page_cursor - 400 if the cursor is malformed
+    """
+    try:
+        created_at, row_id = base64.urlsafe_b64decode(cursor.encode()).decode().split("|", 1)
+        created_at = datetime.fromisoformat(created_at)
+    except ValueError:
+        raise HTTPException(status_code=400, detail="Invalid cursor")
+    row_id = parse_uuid(row_id)
+    if row_id is None:
+        raise HTTPException(status_code=400, detail="Invalid cursor")
+    return created_at, row_id
+
+# Dashboard stats/segments are polled by the UI - cache them briefly in Redis
+STATS_CACHE_TTL = 15
+DASHBOARD_STATS_CACHE_KEY = "cache:dashboard_stats"
+CUSTOMER_SEGMENTS_CACHE_KEY = "cache:customer_segments"
+
+def invalidate_stats_cache():
+    """
+    Drop cached dashboard stats and segments after new orders/messages
+    """
+    if redis_manager:
+        redis_manager.delete_many(DASHBOARD_STATS_CACHE_KEY, CUSTOMER_SEGMENTS_CACHE_KEY)
+
+# WhatsApp "My Orders" reply only changes when the customer places an order
+ORDERS_REPLY_CACHE_TTL = 60
+
+def get_orders_reply_cache_key(customer_id: str) -> str:
+    return "cache:orders_reply:" + customer_id
 
 # Create database tables on startup
 @asynccontextmanager
 async def lifespan(app: FastAPI):
     # --- Startup ---
-    global whatsapp_service, campaign_engine, redis_manager, conversation_manager, support_flow_handler
+    global whatsapp_service, campaign_engine, redis_manager, conversation_manager, support_flow_handler, dashboard_html
     
     # Initialize database
     create_tables()
+    upgrade_schema()
     print("✅ Database initialized!")
     
     # Initialize WhatsApp service
@@ -77,6 +157,8 @@ async def lifespan(app: FastAPI):
             conversation_manager = ConversationState(redis_manager)
             if conversation_manager:
                 support_flow_handler = SupportFlow(conversation_manager)
+            if campaign_engine:
+                campaign_engine.redis_manager = redis_manager
             print("✅ Redis and conversation manager initialized!")
         else:
             print("⚠️  Redis connection failed - conversation state disabled")
@@ -86,6 +168,9 @@ async def lifespan(app: FastAPI):
         print(f"⚠️  Redis initialization failed: {e}")
         redis_manager = None
         conversation_manager = None
+    # Dashboard page is static - read it once instead of on every request
+    dashboard_html = load_dashboard_html()
+    
     print(" API started and all services initialized!")
     yield
     # --- Shutdown (optional) ---
@@ -103,11 +188,8 @@ def get_db():
     This function provides a database session to each API endpoint
     It ensures the session is properly closed after use
     """
-    db = get_database_session()
-    try:
+    with get_database_session() as db:
         yield db
-    finally:
-        db.close()
 
 # Pydantic models for API validation
 class WebhookMessage(BaseModel):
@@ -204,7 +286,8 @@ def health_check(db: Session = Depends(get_db)):
 
 # WhatsApp webhook endpoints
 @app.post("/webhook/whatsapp/twilio", response_class=PlainTextResponse)
-async def twilio_whatsapp_webhook(request: Request, db: Session = Depends(get_db)):
+async def twilio_whatsapp_webhook(request: Request, background_tasks: BackgroundTasks,
+                                  db: Session = Depends(get_db)):
     """
     Real WhatsApp webhook from Twilio
     
@@ -222,83 +305,112 @@ async def twilio_whatsapp_webhook(request: Request, db: Session = Depends(get_db
         
         logger.info(f"📱 Received Twilio webhook: {webhook_data}")
         
-        # Process incoming message using WhatsApp service
-        processed_message = whatsapp_service.process_incoming_webhook(webhook_data)
-        
-        # Find or create customer
-        customer = find_or_create_customer(
-            db=db, 
-            whatsapp_phone=processed_message['from_phone']
-        )
-        
-        # Extract customer name from WhatsApp profile if available
-        profile_name = webhook_data.get('ProfileName', '')
-        if profile_name and not customer.first_name:
-            name_parts = profile_name.split(' ', 1)
-            customer.first_name = name_parts[0]
-            if len(name_parts) > 1:
-                customer.last_name = name_parts[1]
-            customer.updated_at = datetime.utcnow()
-        
-        # Save incoming message to database
-        incoming_msg = Message(
-            customer_id=customer.id,
-            channel="whatsapp",
-            direction="inbound",
-            content=processed_message['message_text'],
-            platform_message_id=processed_message['message_id'],
-            received_at=datetime.fromisoformat(processed_message['timestamp'].replace('Z', '+00:00')),
-            metadata_json=json.dumps({
-                "from_phone": processed_message['from_phone'],
-                "profile_name": profile_name,
-                "raw_webhook": webhook_data
-            })
-        )
-        db.add(incoming_msg)
-        
-        # Generate automated response
-        """
-        Testing for enhanced flow system, comment out original response generation
-        """
-        # response_text = generate_response(processed_message['message_text'], customer, db)
-        # Generate response using enhanced flow system
-        response_text = process_message_with_flows(
-            customer.id, 
-            processed_message['message_text'], 
-            customer, 
-            db
-        )
-        
-        # Save response message to database
-        response_msg = Message(
-            customer_id=customer.id,
-            channel="whatsapp",
-            direction="outbound",
-            content=response_text,
-            sent_at=datetime.utcnow(),
-            bot_handled=True,
-            metadata_json=json.dumps({
-                "triggered_by_message": incoming_msg.id,
-                "response_type": "flow_enhanced" if conversation_manager else "menu_fallback",
-                "has_active_flow": conversation_manager.has_active_session(customer.id) if conversation_manager else False
-            })
-        )
-        db.add(response_msg)
-        
-        # Commit all changes to database
-        db.commit()
-        
-        logger.info(f"✅ Processed WhatsApp message from {customer.first_name or processed_message['from_phone']}")
-        
-        # Return TwiML response to immediately reply to customer
-        twiml_response = whatsapp_service.generate_webhook_response(response_text)
-        return twiml_response
+        # DB, Redis and flow handling all block - keep them off the event loop
+        return await run_in_threadpool(handle_twilio_message, webhook_data, db, background_tasks)
         
     except Exception as e:
         logger.error(f"❌ WhatsApp webhook error: {e}")
         # Return empty response on error (Twilio won't retry)
         return ""
 
+def handle_twilio_message(webhook_data: Dict[str, Any], db: Session, background_tasks: BackgroundTasks) -> str:
+    """
+    Process an incoming Twilio WhatsApp message and build the TwiML reply
+    Runs in the threadpool - everything here is blocking I/O
+    Message logging is deferred to a background task so Twilio gets its reply sooner
+    """
+    now = datetime.utcnow()
+    
+    # Process incoming message using WhatsApp service
+    processed_message = whatsapp_service.process_incoming_webhook(webhook_data)
+    
+    # Find or create customer
+    customer = find_or_create_customer(
+        db=db, 
+        whatsapp_phone=processed_message['from_phone']
+    )
+    
+    # Extract customer name from WhatsApp profile if available
+    profile_name = webhook_data.get('ProfileName', '')
+    if profile_name and not customer.first_name:
+        name_parts = profile_name.split(' ', 1)
+        customer.first_name = name_parts[0]
+        if len(name_parts) > 1:
+            customer.last_name = name_parts[1]
+        customer.updated_at = now
+        db.commit()
+    
+    # Generate automated response
+    """
+    Testing for enhanced flow system, comment out original response generation
+    """
+    # response_text = generate_response(processed_message['message_text'], customer, db)
+    # Generate response using enhanced flow system
+    response_text = process_message_with_flows(
+        customer.id, 
+        processed_message['message_text'], 
+        customer, 
+        db
+    )
+    
+    # Save both messages after the response has gone out
+    background_tasks.add_task(
+        save_twilio_messages, customer.id, processed_message, profile_name, webhook_data, response_text, now
+    )
+    
+    logger.info(f"✅ Processed WhatsApp message from {customer.first_name or processed_message['from_phone']}")
+    
+    # Return TwiML response to immediately reply to customer
+    twiml_response = whatsapp_service.generate_webhook_response(response_text)
+    return twiml_response
+
+def save_twilio_messages(customer_id: str, processed_message: Dict[str, Any], profile_name: str,
+                         webhook_data: Dict[str, Any], response_text: str, now: datetime):
+    """
+    Save an incoming WhatsApp message and our reply (runs as a background task with its own session)
+    """
+    try:
+        with get_database_session() as db:
+            # Save incoming message to database
+            incoming_msg_id = db.execute(
+                insert(Message).values(
+                    customer_id=customer_id,
+                    channel="whatsapp",
+                    direction="inbound",
+                    content=processed_message['message_text'],
+                    platform_message_id=processed_message['message_id'],
+                    received_at=parse_webhook_timestamp(processed_message['timestamp']),
+                    metadata_json={
+                        "from_phone": processed_message['from_phone'],
+                        "profile_name": profile_name,
+                        "raw_webhook": webhook_data
+                    }
+                ).returning(Message.id)
+            ).scalar()
+            
+            # Save response message to database
+            db.execute(
+                insert(Message).values(
+                    customer_id=customer_id,
+                    channel="whatsapp",
+                    direction="outbound",
+                    content=response_text,
+                    sent_at=now,
+                    bot_handled=True,
+                    metadata_json={
+                        "triggered_by_message": incoming_msg_id,
+                        "response_type": "flow_enhanced" if conversation_manager else "menu_fallback",
+                        "has_active_flow": conversation_manager.has_active_session(customer_id) if conversation_manager else False
+                    }
+                )
+            )
+            
+            # Commit all changes to database
+            db.commit()
+        invalidate_stats_cache()
+    except Exception as e:
+        logger.error(f"❌ Failed to save WhatsApp messages for {customer_id}: {e}")
+
 @app.post("/webhook/whatsapp")
 def whatsapp_webhook_json(message: WebhookMessage, db: Session = Depends(get_db)):
     """
@@ -309,6 +421,8 @@ def whatsapp_webhook_json(message: WebhookMessage, db: Session = Depends(get_db)
     logger.info(f"📱 Received JSON WhatsApp webhook from {message.from_phone}")
     
     try:
+        now = datetime.utcnow()
+        
         # Find/create customer
         customer = find_or_create_customer(db=db, whatsapp_phone=message.from_phone)
         
@@ -318,7 +432,7 @@ def whatsapp_webhook_json(message: WebhookMessage, db: Session = Depends(get_db)
             customer.first_name = name_parts[0]
             if len(name_parts) > 1:
                 customer.last_name = name_parts[1]
-            customer.updated_at = datetime.utcnow()
+            customer.updated_at = now
         
         # Save incoming message
         incoming_msg = Message(
@@ -327,7 +441,7 @@ def whatsapp_webhook_json(message: WebhookMessage, db: Session = Depends(get_db)
             direction="inbound",
             content=message.message_text,
             platform_message_id=message.message_id,
-            received_at=datetime.fromisoformat(message.timestamp.replace('Z', '+00:00'))
+            received_at=parse_webhook_timestamp(message.timestamp)
         )
         db.add(incoming_msg)
         
@@ -340,7 +454,7 @@ def whatsapp_webhook_json(message: WebhookMessage, db: Session = Depends(get_db)
             channel="whatsapp",
             direction="outbound",
             content=response_text,
-            sent_at=datetime.utcnow(),
+            sent_at=now,
             bot_handled=True
         )
         db.add(response_msg)
@@ -368,40 +482,59 @@ def shopify_webhook(order: ShopifyOrder, db: Session = Depends(get_db)):
     logger.info(f"🛒 Received Shopify webhook for order {order.order_id}")
     
     try:
+        now = datetime.utcnow()
+        
         # Log raw webhook for debugging
         webhook_event = WebhookEvent(
             source="shopify",
             event_type="order.created",
-            raw_data=order.json()
+            raw_data=order.dict()
         )
         db.add(webhook_event)
         
-        # Find or create customer
-        customer = find_or_create_customer(db=db, email=order.customer_email)
-        
-        # Create order record
-        new_order = Order(
-            customer_id=customer.id,
-            platform_order_id=order.order_id,
-            platform="shopify",
-            total_price=order.total_price,
-            status=order.order_status,
-            items_json=json.dumps(order.items),
-            order_date=datetime.fromisoformat(order.created_at.replace('Z', '+00:00'))
-        )
-        db.add(new_order)
+        # Find or create customer - committed with the order below, not on its own
+        customer = find_or_create_customer(db=db, email=order.customer_email, commit=False)
         
-        # Update customer totals
-        customer.total_orders += order.total_price
-        customer.order_count += 1
-        customer.updated_at = datetime.utcnow()
+        # Create order record - replayed webhooks hit the unique (platform, platform_order_id) key and insert nothing
+        new_order_id = db.execute(
+            pg_insert(Order).values(
+                customer_id=customer.id,
+                platform_order_id=order.order_id,
+                platform="shopify",
+                total_price=order.total_price,
+                status=order.order_status,
+                items_json=order.items,
+                order_date=parse_webhook_timestamp(order.created_at)
+            ).on_conflict_do_nothing(
+                index_elements=["platform", "platform_order_id"]
+            ).returning(Order.id)
+        ).scalar()
+        
+        if new_order_id is None:
+            logger.info(f"🔁 Shopify order {order.order_id} already processed - skipping")
+            webhook_event.processed = True
+            webhook_event.processed_at = now
+            db.commit()
+            return {
+                "status": "duplicate",
+                "customer_id": customer.id,
+                "order_id": order.order_id
+            }
         
-        # Mark webhook as processed
-        webhook_event.processed = True
-        webhook_event.processed_at = datetime.utcnow()
+        # Update customer totals in the database so concurrent orders can't lose an increment;
+        # "fetch" refreshes the loaded customer from RETURNING for the automations below
+        db.execute(
+            update(Customer)
+            .where(Customer.id == customer.id)
+            .values(
+                total_orders=Customer.total_orders + order.total_price,
+                order_count=Customer.order_count + 1,
+                updated_at=now
+            )
+            .execution_options(synchronize_session="fetch")
+        )
         
-        # Commit all changes
-        db.commit()
+        new_order = db.get(Order, new_order_id)
         
         # Trigger simple automations
         automation_actions = trigger_simple_automations(customer, new_order)
@@ -421,17 +554,25 @@ def shopify_webhook(order: ShopifyOrder, db: Session = Depends(get_db)):
                         platform_message_id=whatsapp_result['message_id'],
                         sent_at=datetime.utcnow(),
                         bot_handled=True,
-                        metadata_json=json.dumps({
+                        metadata_json={
                             "trigger": "order_confirmation",
                             "order_id": new_order.id
-                        })
+                        }
                     )
                     db.add(confirmation_msg)
-                    db.commit()
                     automation_actions.append("whatsapp_confirmation_sent")
             except Exception as e:
+                # A failed confirmation must not lose the order - log it and commit anyway
                 logger.error(f"Failed to send WhatsApp order confirmation: {e}")
         
+        # Mark webhook as processed and commit the order, totals and confirmation together
+        webhook_event.processed = True
+        webhook_event.processed_at = now
+        db.commit()
+        invalidate_stats_cache()
+        if redis_manager:
+            redis_manager.delete_data(get_orders_reply_cache_key(customer.id))
+        
         return {
             "status": "success",
             "customer_id": customer.id,
@@ -444,7 +585,7 @@ def shopify_webhook(order: ShopifyOrder, db: Session = Depends(get_db)):
         # Mark webhook as failed
         if 'webhook_event' in locals():
             webhook_event.processing_error = str(e)
-            webhook_event.processed_at = datetime.utcnow()
+            webhook_event.processed_at = now
             db.commit()
         raise HTTPException(status_code=500, detail=str(e))
 
@@ -475,10 +616,10 @@ def send_whatsapp_message(request: SendMessageRequest, db: Session = Depends(get
                 platform_message_id=result['message_id'],
                 sent_at=datetime.utcnow(),
                 bot_handled=False,  # Manual send
-                metadata_json=json.dumps({
+                metadata_json={
                     "send_type": "manual",
                     "api_endpoint": "/send-whatsapp"
-                })
+                }
             )
             db.add(outbound_msg)
             db.commit()
@@ -493,16 +634,27 @@ def send_whatsapp_message(request: SendMessageRequest, db: Session = Depends(get
 
 # Dashboard endpoints
 @app.get("/dashboard", response_class=HTMLResponse)
-async def dashboard():
+async def dashboard(request: Request):
     """
     Serve the web dashboard
     """
-    try:
-        # Read the HTML file
-        with open("templates/dashboard.html", "r", encoding="utf-8") as file:
-            html_content = file.read()
-        return HTMLResponse(content=html_content, status_code=200)
-    except FileNotFoundError:
+    global dashboard_html, dashboard_etag
+    
+    if dashboard_html is None:
+        # Not there at startup - check again in case it was added since
+        dashboard_html = load_dashboard_html()
+    
+    if dashboard_html is not None:
+        if dashboard_etag is None:
+            dashboard_etag = f'"{hashlib.md5(dashboard_html.encode("utf-8")).hexdigest()}"'
+        headers = {"ETag": dashboard_etag, "Cache-Control": DASHBOARD_CACHE_CONTROL}
+        
+        # Page hasn't changed since the browser last fetched it
+        if request.headers.get("if-none-match") == dashboard_etag:
+            return Response(status_code=304, headers=headers)
+        
+        return HTMLResponse(content=dashboard_html, status_code=200, headers=headers)
+    else:
         return HTMLResponse(
             content="""
             <h1>Dashboard not found</h1>
@@ -517,38 +669,41 @@ def get_dashboard_stats(db: Session = Depends(get_db)):
     """
     Get comprehensive dashboard statistics
     """
+    if redis_manager:
+        cached = redis_manager.get_data(DASHBOARD_STATS_CACHE_KEY)
+        if cached:
+            return cached
+    
     try:
-        from sqlalchemy import func
-        
-        # Count totals
-        customer_count = db.query(Customer).count()
-        order_count = db.query(Order).count()
-        message_count = db.query(Message).count()
-        
-        # Calculate revenue
-        total_revenue = db.query(func.sum(Customer.total_orders)).scalar() or 0
-        
         # Get recent activity (last 24 hours)
         since_yesterday = datetime.utcnow() - timedelta(hours=24)
         
-        new_customers_24h = db.query(Customer).filter(
-            Customer.created_at >= since_yesterday
-        ).count()
-        
-        new_orders_24h = db.query(Order).filter(
-            Order.created_at >= since_yesterday
-        ).count()
+        def count_since(model):
+            # (total rows, rows created in the last 24h) as scalar subqueries
+            return (
+                select(func.count()).select_from(model).scalar_subquery(),
+                select(func.count()).select_from(model).where(model.created_at >= since_yesterday).scalar_subquery()
+            )
         
-        new_messages_24h = db.query(Message).filter(
-            Message.created_at >= since_yesterday
-        ).count()
+        # All totals and 24h counts in one round-trip
+        (
+            customer_count, new_customers_24h,
+            order_count, new_orders_24h,
+            message_count, new_messages_24h,
+            total_revenue
+        ) = db.query(
+            *count_since(Customer),
+            *count_since(Order),
+            *count_since(Message),
+            select(func.coalesce(func.sum(Customer.total_orders), 0)).scalar_subquery()
+        ).one()
         
         # Get top customers by revenue
         top_customers = db.query(Customer).filter(
             Customer.total_orders > 0
         ).order_by(Customer.total_orders.desc()).limit(5).all()
         
-        return {
+        stats = {
             "totals": {
                 "customers": customer_count,
                 "orders": order_count,
@@ -576,6 +731,11 @@ def get_dashboard_stats(db: Session = Depends(get_db)):
             "timestamp": datetime.utcnow().isoformat()
         }
         
+        if redis_manager:
+            redis_manager.set_data(DASHBOARD_STATS_CACHE_KEY, stats, STATS_CACHE_TTL)
+        
+        return stats
+        
     except Exception as e:
         logger.error(f"❌ Dashboard stats error: {e}")
         raise HTTPException(status_code=500, detail=str(e))
@@ -586,9 +746,14 @@ def list_customers(limit: int = 50, db: Session = Depends(get_db)):
     """
     Get list of all customers with summary information
     """
-    customers = db.query(Customer).order_by(Customer.created_at.desc()).limit(limit).all()
+    # The full count rides along with the page as a scalar subquery (counted separately only
+    # when the page is empty)
+    total_query = select(func.count()).select_from(Customer).correlate(None)
+    rows = db.query(Customer, total_query.scalar_subquery()).order_by(Customer.created_at.desc()).limit(limit).all()
+    customers = [c for c, _ in rows]
     
     return {
+        "total": rows[0][1] if rows else db.scalar(total_query),
         "count": len(customers),
         "customers": [
             {
@@ -606,15 +771,28 @@ def list_customers(limit: int = 50, db: Session = Depends(get_db)):
     }
 
 @app.get("/customers/{customer_id}")
-def get_customer_details(customer_id: str, db: Session = Depends(get_db)):
+def get_customer_details(customer_id: str, limit: int = 100, offset: int = 0, db: Session = Depends(get_db)):
     """
     Get detailed information about a specific customer
+    Orders and messages are paged (newest first) so busy customers don't load their whole history
     """
+    customer_id = parse_uuid(customer_id)
+    if customer_id is None:
+        raise HTTPException(status_code=404, detail="Customer not found")
+    
     customer = db.query(Customer).filter(Customer.id == customer_id).first()
     
     if not customer:
         raise HTTPException(status_code=404, detail="Customer not found")
     
+    customer_orders = db.query(Order).filter(
+        Order.customer_id == customer_id
+    ).order_by(Order.order_date.desc()).offset(offset).limit(limit).all()
+    
+    customer_messages = db.query(Message).filter(
+        Message.customer_id == customer_id
+    ).order_by(Message.created_at.desc()).offset(offset).limit(limit).all()
+    
     # Get customer's orders
     orders = [
         {
@@ -624,9 +802,9 @@ def get_customer_details(customer_id: str, db: Session = Depends(get_db)):
             "total": float(o.total_price),
             "status": o.status,
             "date": o.order_date.isoformat(),
-            "items": json.loads(o.items_json) if o.items_json else []
+            "items": o.items_json or []
         }
-        for o in customer.orders
+        for o in customer_orders
     ]
     
     # Get customer's messages
@@ -639,7 +817,7 @@ def get_customer_details(customer_id: str, db: Session = Depends(get_db)):
             "timestamp": (m.sent_at or m.received_at or m.created_at).isoformat(),
             "bot_handled": m.bot_handled
         }
-        for m in customer.messages
+        for m in customer_messages
     ]
     
     return {
@@ -658,14 +836,23 @@ def get_customer_details(customer_id: str, db: Session = Depends(get_db)):
     }
 
 @app.get("/messages/recent")
-def get_recent_messages(limit: int = 50, db: Session = Depends(get_db)):
+def get_recent_messages(limit: int = 50, cursor: Optional[str] = None, db: Session = Depends(get_db)):
     """
     Get recent messages across all customers
+    Pass back next_cursor to fetch the following page; total is the count of all messages on every page
     """
-    messages = db.query(Message).order_by(Message.created_at.desc()).limit(limit).all()
+    # Counted in an uncorrelated subquery so the cursor filter doesn't shrink it
+    total_query = select(func.count()).select_from(Message).correlate(None)
+    query = db.query(Message, total_query.scalar_subquery()).options(joinedload(Message.customer))
+    if cursor:
+        query = query.filter(tuple_(Message.created_at, Message.id) < decode_page_cursor(cursor))
+    rows = query.order_by(Message.created_at.desc(), Message.id.desc()).limit(limit).all()
+    messages = [m for m, _ in rows]
     
     return {
-        "total": len(messages),
+        "total": rows[0][1] if rows else db.scalar(total_query),
+        "count": len(messages),
+        "next_cursor": encode_page_cursor(messages[-1].created_at, messages[-1].id) if len(messages) == limit else None,
         "messages": [
             {
                 "id": m.id,
@@ -682,14 +869,23 @@ def get_recent_messages(limit: int = 50, db: Session = Depends(get_db)):
     }
 
 @app.get("/orders/recent")
-def get_recent_orders(limit: int = 20, db: Session = Depends(get_db)):
+def get_recent_orders(limit: int = 20, cursor: Optional[str] = None, db: Session = Depends(get_db)):
     """
     Get recent orders across all customers
+    Pass back next_cursor to fetch the following page; total is the count of all orders on every page
     """
-    orders = db.query(Order).order_by(Order.created_at.desc()).limit(limit).all()
+    # Counted in an uncorrelated subquery so the cursor filter doesn't shrink it
+    total_query = select(func.count()).select_from(Order).correlate(None)
+    query = db.query(Order, total_query.scalar_subquery()).options(joinedload(Order.customer))
+    if cursor:
+        query = query.filter(tuple_(Order.created_at, Order.id) < decode_page_cursor(cursor))
+    rows = query.order_by(Order.created_at.desc(), Order.id.desc()).limit(limit).all()
+    orders = [o for o, _ in rows]
     
     return {
-        "total": len(orders),
+        "total": rows[0][1] if rows else db.scalar(total_query),
+        "count": len(orders),
+        "next_cursor": encode_page_cursor(orders[-1].created_at, orders[-1].id) if len(orders) == limit else None,
         "orders": [
             {
                 "id": o.id,
@@ -700,13 +896,50 @@ def get_recent_orders(limit: int = 20, db: Session = Depends(get_db)):
                 "total": float(o.total_price),
                 "status": o.status,
                 "date": o.order_date.isoformat(),
-                "items": json.loads(o.items_json) if o.items_json else []
+                "items": o.items_json or []
             }
             for o in orders
         ]
     }
 
 
+@app.get("/orders/export")
+def export_orders():
+    """
+    Download all orders as CSV, streamed in chunks instead of built in memory
+    """
+    def generate_rows():
+        buffer = io.StringIO()
+        writer = csv.writer(buffer)
+        writer.writerow(["order_id", "platform", "customer_email", "total", "status", "date"])
+        
+        # The request's session is closed before the body streams, so use our own
+        with get_database_session() as db:
+            rows = db.query(
+                Order.platform_order_id, Order.platform, Customer.email,
+                Order.total_price, Order.status, Order.order_date
+            ).join(Customer, Order.customer_id == Customer.id).order_by(
+                Order.created_at.desc()
+            ).yield_per(1000)
+            
+            for i, row in enumerate(rows, 1):
+                writer.writerow([
+                    row.platform_order_id, row.platform, row.email,
+                    row.total_price, row.status, row.order_date.isoformat()
+                ])
+                if i % 1000 == 0:
+                    yield buffer.getvalue()
+                    buffer.seek(0)
+                    buffer.truncate()
+        
+        yield buffer.getvalue()
+    
+    return StreamingResponse(
+        generate_rows(),
+        media_type="text/csv",
+        headers={"Content-Disposition": "attachment; filename=orders.csv"}
+    )
+
 # Add these new endpoints after existing ones
 
 @app.post("/send-interactive")
@@ -736,10 +969,10 @@ def send_interactive_message(request: InteractiveMessageRequest, db: Session = D
                 platform_message_id=result['message_id'],
                 sent_at=datetime.utcnow(),
                 bot_handled=False,
-                metadata_json=json.dumps({
+                metadata_json={
                     "message_type": "interactive_buttons",
                     "buttons": request.buttons
-                })
+                }
             )
             db.add(outbound_msg)
             db.commit()
@@ -775,11 +1008,11 @@ def send_menu_message(request: MenuMessageRequest, db: Session = Depends(get_db)
                 platform_message_id=result['message_id'],
                 sent_at=datetime.utcnow(),
                 bot_handled=False,
-                metadata_json=json.dumps({
+                metadata_json={
                     "message_type": "menu",
                     "title": request.title,
                     "menu_items": request.menu_items
-                })
+                }
             )
             db.add(outbound_msg)
             db.commit()
@@ -798,33 +1031,25 @@ def send_broadcast(request: BroadcastRequest, db: Session = Depends(get_db)):
         raise HTTPException(status_code=503, detail="WhatsApp service not available")
     
     try:
-        # Get customers based on segments
-        customers = []
+        # Get customers based on segments - only id and phone are needed
+        query = db.query(Customer.id, Customer.whatsapp_phone).filter(
+            Customer.whatsapp_phone.isnot(None)
+        )
         
         if not request.customer_segments or "all" in request.customer_segments:
             # All customers with WhatsApp
-            customers = db.query(Customer).filter(
-                Customer.whatsapp_phone.isnot(None)
-            ).all()
+            customers = query.all()
         else:
-            # Specific segments
+            # Specific segments - OR-ed into one query
+            segment_conditions = []
             if "vip" in request.customer_segments:
-                vip_customers = db.query(Customer).filter(
-                    Customer.order_count >= 3,
-                    Customer.whatsapp_phone.isnot(None)
-                ).all()
-                customers.extend(vip_customers)
-            
+                segment_conditions.append(Customer.order_count >= 3)
             if "new" in request.customer_segments:
-                new_customers = db.query(Customer).filter(
-                    Customer.order_count == 0,
-                    Customer.whatsapp_phone.isnot(None)
-                ).all()
-                customers.extend(new_customers)
+                segment_conditions.append(Customer.order_count == 0)
+            
+            customers = query.filter(or_(*segment_conditions)).all() if segment_conditions else []
         
-        # Remove duplicates
-        unique_customers = {c.id: c for c in customers}.values()
-        phone_list = [c.whatsapp_phone for c in unique_customers if c.whatsapp_phone]
+        phone_list = [c.whatsapp_phone for c in customers]
         
         if not phone_list:
             return {"status": "error", "message": "No customers found for selected segments"}
@@ -832,28 +1057,34 @@ def send_broadcast(request: BroadcastRequest, db: Session = Depends(get_db)):
         # Send broadcast
         result = whatsapp_service.broadcast_message(phone_list, request.message)
         
-        # Log broadcast in database
-        for customer in unique_customers:
-            if customer.whatsapp_phone in result['results']['successful']:
-                broadcast_msg = Message(
-                    customer_id=customer.id,
-                    channel="whatsapp",
-                    direction="outbound",
-                    content=request.message,
-                    sent_at=datetime.utcnow(),
-                    bot_handled=False,
-                    metadata_json=json.dumps({
-                        "message_type": "broadcast",
-                        "segments": request.customer_segments
-                    })
-                )
-                db.add(broadcast_msg)
+        # Log broadcast in database - one multi-row insert instead of an ORM object per customer
+        successful = set(result['results']['successful'])
+        sent_at = datetime.utcnow()
+        broadcast_metadata = {
+            "message_type": "broadcast",
+            "segments": request.customer_segments
+        }
+        broadcast_rows = [
+            {
+                "customer_id": customer.id,
+                "channel": "whatsapp",
+                "direction": "outbound",
+                "content": request.message,
+                "sent_at": sent_at,
+                "bot_handled": False,
+                "metadata_json": broadcast_metadata
+            }
+            for customer in customers
+            if customer.whatsapp_phone in successful
+        ]
+        if broadcast_rows:
+            db.execute(insert(Message), broadcast_rows)
         
         db.commit()
         
         return {
             "status": "success",
-            "total_customers": len(unique_customers),
+            "total_customers": len(customers),
             "broadcast_result": result
         }
         
@@ -865,6 +1096,11 @@ def get_customer_segments(db: Session = Depends(get_db)):
     """
     Get customer segment statistics
     """
+    if redis_manager:
+        cached = redis_manager.get_data(CUSTOMER_SEGMENTS_CACHE_KEY)
+        if cached:
+            return cached
+    
     try:
         total_customers = db.query(Customer).count()
         whatsapp_customers = db.query(Customer).filter(
@@ -879,7 +1115,7 @@ def get_customer_segments(db: Session = Depends(get_db)):
             Customer.order_count == 0
         ).count()
         
-        return {
+        segments = {
             "segments": {
                 "all": {
                     "total": total_customers,
@@ -896,6 +1132,11 @@ def get_customer_segments(db: Session = Depends(get_db)):
             }
         }
         
+        if redis_manager:
+            redis_manager.set_data(CUSTOMER_SEGMENTS_CACHE_KEY, segments, STATS_CACHE_TTL)
+        
+        return segments
+        
     except Exception as e:
         raise HTTPException(status_code=500, detail=str(e))
     
@@ -926,12 +1167,12 @@ def simulate_cart_abdanmonment(customer_phone: str, product_sku: str, db: Sessio
             raise HTTPException(status_code = 404, detail = "product not found")
         
         from database import simulate_cart_abandonment
-        cart_item = simulate_cart_abandonment(db, customer.id, product.id)
+        cart_item_id = simulate_cart_abandonment(db, customer.id, product.id)
 
         return{
             "status": "success",
             "message": f"Simulated cart abandonment for {product.name}",
-            "cart-item_id":cart_item.id
+            "cart-item_id":cart_item_id
         }
     
     except Exception as e:
@@ -979,10 +1220,19 @@ def list_campaigns(db: Session = Depends(get_db)):
     """
     campaigns = db.query(Campaign).all()
     
+    # Send/conversion counts aggregated in the database - one row per campaign, not per send
+    send_counts = {
+        campaign_id: (total_sends, conversions)
+        for campaign_id, total_sends, conversions in db.query(
+            CampaignSend.campaign_id,
+            func.count(),
+            func.count().filter(CampaignSend.converted == True)
+        ).group_by(CampaignSend.campaign_id)
+    }
+    
     campaign_stats = []
     for campaign in campaigns:
-        total_sends = len(campaign.campaign_sends)
-        conversions = len([s for s in campaign.campaign_sends if s.converted])
+        total_sends, conversions = send_counts.get(campaign.id, (0, 0))
         
         campaign_stats.append({
             "id": campaign.id,
@@ -1008,6 +1258,10 @@ def get_campaign_sends(campaign_id: str, limit: int = 50, db: Session = Depends(
     """
     Get campaign send history for a specific campaign
     """
+    campaign_id = parse_uuid(campaign_id)
+    if campaign_id is None:
+        return {"campaign_sends": [], "total_sends": 0}
+    
     sends = db.query(CampaignSend).filter(
         CampaignSend.campaign_id == campaign_id
     ).order_by(CampaignSend.sent_at.desc()).limit(limit).all()
@@ -1076,9 +1330,8 @@ def simulate_full_cart_abandonment(
         # If campaign engine available and enough time passed, trigger campaigns
         triggered_campaigns = []
         if campaign_engine and hours_ago >= 1:
-            # Find matching campaigns
-            ready_carts = campaign_engine.find_abandoned_carts_for_campaigns(db)
-            matching_carts = [c for c in ready_carts if c["cart"].id == cart_item.id]
+            # Find matching campaigns - just this cart, it is backdated before the scan watermarks
+            matching_carts = campaign_engine.find_abandoned_carts_for_campaigns(db, cart_item_ids=[cart_item.id])
             
             for cart_data in matching_carts:
                 result = campaign_engine.send_campaign_message(db, cart_data)
@@ -1207,21 +1460,32 @@ def list_active_conversations():
         # Get all conversation keys
         keys = redis_manager.client.keys("conversation:*")
         
+        # States, activity sidecar keys and TTLs each in one round-trip, not one per conversation
+        sessions = [(key, state) for key, state in zip(keys, redis_manager.get_many(keys)) if state]
+        if conversation_manager:
+            activities = redis_manager.get_many([
+                conversation_manager.get_activity_key(state.get("customer_id") or "") for _, state in sessions
+            ])
+        else:
+            activities = [None] * len(sessions)
+        pipe = redis_manager.pipeline()
+        for key, _ in sessions:
+            pipe.ttl(key)
+        ttls = pipe.execute() if sessions else []
+        
         conversations = []
-        for key in keys:
+        for (key, state), last_activity, ttl in zip(sessions, activities, ttls):
             try:
-                state = redis_manager.get_data(key)
-                if state:
-                    conversations.append({
-                        "key": key,
-                        "customer_id": state.get("customer_id"),
-                        "session_id": state.get("session_id"), 
-                        "current_flow": state.get("current_flow"),
-                        "current_step": state.get("current_step"),
-                        "last_activity": state.get("metadata", {}).get("last_activity"),
-                        "message_count": state.get("metadata", {}).get("message_count", 0),
-                        "ttl": redis_manager.get_ttl(key)
-                    })
+                conversations.append({
+                    "key": key,
+                    "customer_id": state.get("customer_id"),
+                    "session_id": state.get("session_id"), 
+                    "current_flow": state.get("current_flow"),
+                    "current_step": state.get("current_step"),
+                    "last_activity": last_activity or state.get("metadata", {}).get("last_activity"),
+                    "message_count": state.get("metadata", {}).get("message_count", 0),
+                    "ttl": ttl
+                })
             except Exception as e:
                 logger.warning(f"Error reading conversation {key}: {e}")
         
@@ -1244,12 +1508,9 @@ def create_test_conversation(customer_phone: str, flow_name: str = "support"):
     
     try:
         # Find or create customer
-        db = get_database_session()
-        try:
+        with get_database_session() as db:
             customer = find_or_create_customer(db=db, whatsapp_phone=customer_phone)
             customer_id = customer.id
-        finally:
-            db.close()
         
         # Create conversation session
         state = conversation_manager.create_new_session(customer_id)
@@ -1281,18 +1542,13 @@ def clear_conversation(customer_phone: str):
     
     try:
         # Find customer
-        db = get_database_session()
-        try:
-            customer = db.query(Customer).filter(
+        with get_database_session() as db:
+            customer_id = db.query(Customer.id).filter(
                 Customer.whatsapp_phone == customer_phone
-            ).first()
+            ).limit(1).scalar()
             
-            if not customer:
+            if not customer_id:
                 return {"error": "Customer not found"}
-            
-            customer_id = customer.id
-        finally:
-            db.close()
         
         # Clear conversation session
         if conversation_manager.clear_session(customer_id):
@@ -1316,12 +1572,9 @@ def test_support_flow_api(customer_phone: str, message: str):
     
     try:
         # Find or create customer
-        db = get_database_session()
-        try:
+        with get_database_session() as db:
             customer = find_or_create_customer(db=db, whatsapp_phone=customer_phone)
             customer_id = customer.id
-        finally:
-            db.close()
         
         # Process message through flow system
         response = process_message_with_flows(customer_id, message, customer, db)
@@ -1354,12 +1607,9 @@ def simulate_support_conversation(customer_phone: str):
     
     try:
         # Find or create customer
-        db = get_database_session()
-        try:
+        with get_database_session() as db:
             customer = find_or_create_customer(db=db, whatsapp_phone=customer_phone)
             customer_id = customer.id
-        finally:
-            db.close()
         
         # Simulate conversation steps
         conversation_steps = [
@@ -1413,18 +1663,13 @@ def get_customer_flow_status(customer_phone: str):
     
     try:
         # Find customer
-        db = get_database_session()
-        try:
-            customer = db.query(Customer).filter(
+        with get_database_session() as db:
+            customer_id = db.query(Customer.id).filter(
                 Customer.whatsapp_phone == customer_phone
-            ).first()
+            ).limit(1).scalar()
             
-            if not customer:
+            if not customer_id:
                 return {"error": "Customer not found"}
-            
-            customer_id = customer.id
-        finally:
-            db.close()
         
         # Get conversation state
         current_state = conversation_manager.get_state(customer_id)
@@ -1537,97 +1782,187 @@ def detect_user_choice(message_text: str, options_count: int) -> Optional[int]:
     """
     text = message_text.strip()
     
-    # Check if message is just a number
-    if text.isdigit():
+    # Menus are numbered 1-9, so the first character decides; compare it as a
+    # character instead of round-tripping through int()
+    first = text[:1]
+    if not ("0" <= first <= "9"):
+        return None
+    
+    # Whole multi-digit replies only matter for menus with 10+ options
+    if options_count > 9 and text.isdigit():
         choice = int(text)
         if 1 <= choice <= options_count:
             return choice
     
-    # Check for number at start of message
-    if len(text) > 0 and text[0].isdigit():
-        choice = int(text[0])
-        if 1 <= choice <= options_count:
-            return choice
+    choice = ord(first) - 48
+    if 1 <= choice <= options_count:
+        return choice
     
     return None
 
+
 def handle_main_menu_selection(choice: int, customer: Customer, db: Session) -> str:
     """
     Handle main menu selections
     """
-    if choice == 1:  # My Orders
-        return handle_orders_request(customer, db)
-    elif choice == 2:  # Products
-        return handle_products_request(customer, db)
-    elif choice == 3:  # Support
-        return f"Hi {customer.first_name or 'there'}! 🆘\n\nI'm here to help! You can ask me about:\n• Order issues\n• Product questions\n• Returns & refunds\n• Account problems\n\nWhat do you need help with?"
-    elif choice == 4:  # Account
-        return handle_account_request(customer, db)
-    else:
+    handler = MENU_HANDLERS.get(choice)
+    if handler is None:
         return "Sorry, I didn't understand that choice. Please reply with 1, 2, 3, or 4."
+    return handler(customer, db)
+
+def handle_support_request(customer: Customer, db: Session) -> str:
+    """
+    Show what the support menu can help with
+    """
+    return f"Hi {customer.first_name or 'there'}! 🆘\n\nI'm here to help! You can ask me about:\n• Order issues\n• Product questions\n• Returns & refunds\n• Account problems\n\nWhat do you need help with?"
+
+# Month names for reply dates - same output as strftime("%b"/"%B") in the default C locale
+MONTH_ABBR = ("Jan", "Feb", "Mar", "Apr", "May", "Jun", "Jul", "Aug", "Sep", "Oct", "Nov", "Dec")
+MONTH_FULL = ("January", "February", "March", "April", "May", "June",
+              "July", "August", "September", "October", "November", "December")
+
+# Order status -> emoji shown in replies; anything else is still in progress
+STATUS_EMOJI = {"delivered": "✅", "shipped": "🚚"}
+PENDING_STATUS_EMOJI = "⏳"
 
 def handle_orders_request(customer: Customer, db: Session) -> str:
     """
     Handle order status requests
     """
-    recent_orders = db.query(Order).filter(
+    cache_key = get_orders_reply_cache_key(customer.id)
+    if redis_manager:
+        cached = redis_manager.get_data(cache_key)
+        if cached:
+            return cached["text"]
+    
+    orders_text = build_orders_reply(customer, db)
+    
+    if redis_manager:
+        redis_manager.set_data(cache_key, {"text": orders_text}, ORDERS_REPLY_CACHE_TTL)
+    
+    return orders_text
+
+def build_orders_reply(customer: Customer, db: Session) -> str:
+    """
+    Render the customer's five most recent orders
+    """
+    # Only the columns the reply shows - all covered by ix_orders_customer_order_date
+    recent_orders = db.query(
+        Order.platform_order_id, Order.status, Order.total_price, Order.order_date
+    ).filter(
         Order.customer_id == customer.id
     ).order_by(Order.order_date.desc()).limit(5).all()
     
     if not recent_orders:
         return f"Hi {customer.first_name or 'there'}! 📦\n\nI don't see any orders for you yet. Ready to place your first order? Check out our products!"
     
-    orders_text = f"*Your Recent Orders* 📦\n\n"
+    parts = ["*Your Recent Orders* 📦\n\n"]
     for i, order in enumerate(recent_orders, 1):
-        status_emoji = "✅" if order.status == "delivered" else "🚚" if order.status == "shipped" else "⏳"
-        orders_text += f"{i}. Order {order.platform_order_id}\n"
-        orders_text += f"   {status_emoji} {order.status.title()}\n"
-        orders_text += f"   💰 ${order.total_price}\n"
-        orders_text += f"   📅 {order.order_date.strftime('%b %d, %Y')}\n\n"
+        status_emoji = STATUS_EMOJI.get(order.status, PENDING_STATUS_EMOJI)
+        parts.append(
+            f"{i}. Order {order.platform_order_id}\n"
+            f"   {status_emoji} {order.status.title()}\n"
+            f"   💰 ${order.total_price}\n"
+            f"   📅 {MONTH_ABBR[order.order_date.month - 1]} {order.order_date.day:02d}, {order.order_date.year}\n\n"
+        )
+    parts.append("Need help with any of these orders? Just ask!")
     
-    return orders_text + "Need help with any of these orders? Just ask!"
+    return "".join(parts)
+
+# Simple product catalog (in real app, this would come from database) - the reply never
+# changes, so it is rendered once at import
+CATALOG_PRODUCTS = [
+    {"name": "Wireless Headphones", "price": 99.99, "id": "WH001"},
+    {"name": "Bluetooth Speaker", "price": 79.99, "id": "BS002"},
+    {"name": "Phone Case", "price": 24.99, "id": "PC003"},
+    {"name": "Charging Cable", "price": 19.99, "id": "CC004"},
+    {"name": "Power Bank", "price": 49.99, "id": "PB005"}
+]
+
+PRODUCTS_TEXT = (
+    "*Our Products* 🛍️\n\n"
+    + "".join(
+        f"{i}. *{product['name']}*\n   💰 ${product['price']}\n   🆔 {product['id']}\n\n"
+        for i, product in enumerate(CATALOG_PRODUCTS, 1)
+    )
+    + "Interested in any product? Just tell me the name or number!"
+)
 
 def handle_products_request(customer: Customer, db: Session) -> str:
     """
     Show product catalog
     """
-    # Simple product catalog (in real app, this would come from database)
-    products = [
-        {"name": "Wireless Headphones", "price": 99.99, "id": "WH001"},
-        {"name": "Bluetooth Speaker", "price": 79.99, "id": "BS002"},
-        {"name": "Phone Case", "price": 24.99, "id": "PC003"},
-        {"name": "Charging Cable", "price": 19.99, "id": "CC004"},
-        {"name": "Power Bank", "price": 49.99, "id": "PB005"}
-    ]
-    
-    catalog_text = f"*Our Products* 🛍️\n\n"
-    for i, product in enumerate(products, 1):
-        catalog_text += f"{i}. *{product['name']}*\n"
-        catalog_text += f"   💰 ${product['price']}\n"
-        catalog_text += f"   🆔 {product['id']}\n\n"
-    
-    catalog_text += "Interested in any product? Just tell me the name or number!"
-    return catalog_text
+    return PRODUCTS_TEXT
+
+def format_account_reply(first_name, last_name, email, phone, order_count, total_orders, created_at) -> str:
+    """
+    Render the account summary from the customer fields it shows
+    """
+    vip_line = "⭐ *VIP Customer Status* - Thank you for your loyalty!\n\n" if order_count >= 3 else ""
+    
+    return (
+        f"*Your Account* 👤\n\n"
+        f"📝 Name: {first_name or 'Not set'} {last_name or ''}\n"
+        f"📧 Email: {email or 'Not set'}\n"
+        f"📱 Phone: {phone or 'Not set'}\n"
+        f"🛒 Total Orders: {order_count}\n"
+        f"💰 Total Spent: ${total_orders:.2f}\n"
+        f"📅 Customer Since: {MONTH_FULL[created_at.month - 1]} {created_at.year}\n\n"
+        f"{vip_line}"
+        "Need to update any information? Just let me know!"
+    )
 
 def handle_account_request(customer: Customer, db: Session) -> str:
     """
     Show account information
     """
-    account_text = f"*Your Account* 👤\n\n"
-    account_text += f"📝 Name: {customer.first_name or 'Not set'} {customer.last_name or ''}\n"
-    account_text += f"📧 Email: {customer.email or 'Not set'}\n"
-    account_text += f"📱 Phone: {customer.whatsapp_phone or customer.phone or 'Not set'}\n"
-    account_text += f"🛒 Total Orders: {customer.order_count}\n"
-    account_text += f"💰 Total Spent: ${customer.total_orders:.2f}\n"
-    account_text += f"📅 Customer Since: {customer.created_at.strftime('%B %Y')}\n\n"
-    
-    if customer.order_count >= 3:
-        account_text += "⭐ *VIP Customer Status* - Thank you for your loyalty!\n\n"
-    
-    account_text += "Need to update any information? Just let me know!"
-    return account_text
+    return format_account_reply(
+        customer.first_name,
+        customer.last_name,
+        customer.email,
+        customer.whatsapp_phone or customer.phone,
+        customer.order_count,
+        customer.total_orders,
+        customer.created_at
+    )
+
+def handle_greeting(customer: Customer, db: Session) -> str:
+    """
+    Greeting or menu request
+    """
+    return f"Hi {customer.first_name or 'there'}! 👋 Welcome!\n\nWhat can I help you with today?\n\n1. 📦 My Orders\n2. 🛍️ Products\n3. 🆘 Support\n4. 👤 My Account\n\nReply with the number of your choice."
+
+def handle_returns_request(customer: Customer, db: Session) -> str:
+    """
+    Return/refund requests
+    """
+    return f"Hi {customer.first_name or 'there'}! I can help with returns. 🔄\n\n1. ✅ Yes, start return process\n2. ❌ No, just asking\n\nWhich option applies to you?"
+
+def handle_thanks(customer: Customer, db: Session) -> str:
+    """
+    Thank you
+    """
+    return f"You're welcome, {customer.first_name or 'there'}! 😊\n\nAnything else I can help with? Type 'menu' to see all options."
+
+# Reply handlers, all called as handler(customer, db)
+MENU_HANDLERS = {
+    1: handle_orders_request,    # My Orders
+    2: handle_products_request,  # Products
+    3: handle_support_request,   # Support
+    4: handle_account_request,   # Account
+}
+
+INTENT_HANDLERS = {
+    "greeting": handle_greeting,
+    "orders": handle_orders_request,
+    "products": handle_products_request,
+    "account": handle_account_request,
+    "returns": handle_returns_request,
+    "thanks": handle_thanks,
+}
 
 # Business logic functions
+
 def generate_response(message_text: str, customer: Customer, db: Session) -> str:
     """
     Enhanced response generation with interactive menus
@@ -1640,64 +1975,45 @@ def generate_response(message_text: str, customer: Customer, db: Session) -> str
     if menu_choice:
         return handle_main_menu_selection(menu_choice, customer, db)
     
-    # Greeting or menu request
-    if any(word in text for word in ["hi", "hello", "hey", "menu", "start", "help"]):
-        return f"Hi {name}! 👋 Welcome!\n\nWhat can I help you with today?\n\n1. 📦 My Orders\n2. 🛍️ Products\n3. 🆘 Support\n4. 👤 My Account\n\nReply with the number of your choice."
-    
-    # Direct order status requests
-    elif any(word in text for word in ["order", "status", "track", "shipping"]):
-        return handle_orders_request(customer, db)
-    
-    # Product inquiries
-    elif any(word in text for word in ["product", "catalog", "buy", "shop", "price"]):
-        return handle_products_request(customer, db)
-    
-    # Account requests
-    elif any(word in text for word in ["account", "profile", "info", "details"]):
-        return handle_account_request(customer, db)
-    
-    # Return/refund requests
-    elif any(word in text for word in ["return", "refund", "exchange", "cancel"]):
-        return f"Hi {name}! I can help with returns. 🔄\n\n1. ✅ Yes, start return process\n2. ❌ No, just asking\n\nWhich option applies to you?"
-    
-    # Thank you
-    elif any(word in text for word in ["thank", "thanks", "appreciate"]):
-        return f"You're welcome, {name}! 😊\n\nAnything else I can help with? Type 'menu' to see all options."
+    # Keyword intent (greeting, orders, products, ...) -> its reply handler
+    handler = INTENT_HANDLERS.get(detect_intent(text))
+    if handler:
+        return handler(customer, db)
     
     # Default - show menu
-    else:
-        return f"Thanks for your message, {name}! 💬\n\nI want to help you properly. Here's what I can do:\n\n1. 📦 Check Orders\n2. 🛍️ Browse Products\n3. 🆘 Get Support\n4. 👤 Account Info\n\nReply with a number or type 'menu' anytime!"
+    return f"Thanks for your message, {name}! 💬\n\nI want to help you properly. Here's what I can do:\n\n1. 📦 Check Orders\n2. 🛍️ Browse Products\n3. 🆘 Get Support\n4. 👤 Account Info\n\nReply with a number or type 'menu' anytime!"
+
+# Order automations: (condition, action, log message), checked in this order
+AUTOMATION_RULES = [
+    # First-time customer welcome
+    (lambda customer, order: customer.order_count == 1,
+     "welcome_new_customer", "🎉 New customer welcome triggered: {customer.first_name} (${order.total_price})"),
+    # High-value order processing
+    (lambda customer, order: order.total_price > 100,
+     "high_value_order_alert", "💰 High value order detected: ${order.total_price} from {customer.first_name}"),
+    # VIP customer recognition (3+ orders)
+    (lambda customer, order: customer.order_count >= 3,
+     "vip_customer_recognition", "⭐ VIP customer activity: {customer.first_name} (Order #{customer.order_count})"),
+    # Large order special handling
+    (lambda customer, order: order.total_price > 500,
+     "premium_order_handling", "💎 Premium order detected: ${order.total_price} - Special handling activated"),
+    # Returning customer appreciation
+    (lambda customer, order: 1 < customer.order_count < 3,
+     "returning_customer_thanks", "🔄 Returning customer: {customer.first_name} (Order #{customer.order_count})"),
+]
 
 def trigger_simple_automations(customer: Customer, order: Order) -> List[str]:
     """
     Trigger simple automation workflows based on customer and order data
     """
     actions = []
+    log_enabled = logger.isEnabledFor(logging.INFO)
     
-    # First-time customer welcome
-    if customer.order_count == 1:
-        actions.append("welcome_new_customer")
-        logger.info(f"🎉 New customer welcome triggered: {customer.first_name} (${order.total_price})")
-    
-    # High-value order processing
-    if order.total_price > 100:
-        actions.append("high_value_order_alert")
-        logger.info(f"💰 High value order detected: ${order.total_price} from {customer.first_name}")
-    
-    # VIP customer recognition (3+ orders)
-    if customer.order_count >= 3:
-        actions.append("vip_customer_recognition")
-        logger.info(f"⭐ VIP customer activity: {customer.first_name} (Order #{customer.order_count})")
-    
-    # Large order special handling
-    if order.total_price > 500:
-        actions.append("premium_order_handling")
-        logger.info(f"💎 Premium order detected: ${order.total_price} - Special handling activated")
-    
-    # Returning customer appreciation
-    if customer.order_count > 1 and customer.order_count < 3:
-        actions.append("returning_customer_thanks")
-        logger.info(f"🔄 Returning customer: {customer.first_name} (Order #{customer.order_count})")
+    for condition, action, log_message in AUTOMATION_RULES:
+        if condition(customer, order):
+            actions.append(action)
+            if log_enabled:
+                logger.info(log_message.format(customer=customer, order=order))
     
     return actions
 
@@ -1,13 +1,45 @@
 # redis_manager.py - Basic Redis operations for conversation state
 
 import redis
+from redis.backoff import ExponentialBackoff
+from redis.retry import Retry
 import json
 import logging
-from typing import Optional, Dict, Any
+from typing import Optional, Dict, Any, List
 from datetime import datetime
 
 logger = logging.getLogger(__name__)
 
+# Shared by all request threads; callers wait for a free connection rather than
+# opening unbounded sockets when the pool is busy
+REDIS_MAX_CONNECTIONS = 64
+REDIS_POOL_TIMEOUT = 5
+
+# A slow or restarting Redis shouldn't hang request threads: short socket timeouts,
+# a few backed-off retries, and a PING on connections idle longer than the interval
+REDIS_SOCKET_TIMEOUT = 1
+REDIS_RETRIES = 3
+REDIS_HEALTH_CHECK_INTERVAL = 30
+
+# json.dumps builds a new encoder whenever it gets non-default options, so keep one
+# (compact separators; default=str handles datetime objects)
+_json_encoder = json.JSONEncoder(default=str, separators=(",", ":"))
+_json_decoder = json.JSONDecoder()
+
+# GET + EXPIRE, and SETEX the extra "touch" keys only if the main key exists - one round-trip
+# that never leaves touch keys behind for a missing key. KEYS[1] is the main key, KEYS[2..]
+# the touch keys with their values in ARGV[2..]; ARGV[1] is the TTL
+GET_AND_REFRESH_SCRIPT = """
+local value = redis.call('GET', KEYS[1])
+if value then
+    redis.call('EXPIRE', KEYS[1], ARGV[1])
+    for i = 2, #KEYS do
+        redis.call('SETEX', KEYS[i], ARGV[1], ARGV[i])
+    end
+end
+return value
+"""
+
 class RedisManager:
     """
     Basic Redis connection and operations for conversation state
@@ -26,8 +58,10 @@ class RedisManager:
         self.host = host
         self.port = port
         self.db = db
+        self.pool = None
         self.client = None
         self.is_connected = False
+        self._get_and_refresh = None
     
     def connect(self) -> bool:
         """
@@ -37,12 +71,21 @@ class RedisManager:
             bool: True if connected successfully, False otherwise
         """
         try:
-            self.client = redis.Redis(
+            self.pool = redis.BlockingConnectionPool(
                 host=self.host, 
                 port=self.port, 
                 db=self.db,
+                max_connections=REDIS_MAX_CONNECTIONS,
+                timeout=REDIS_POOL_TIMEOUT,
+                socket_timeout=REDIS_SOCKET_TIMEOUT,
+                socket_connect_timeout=REDIS_SOCKET_TIMEOUT,
+                retry=Retry(ExponentialBackoff(), REDIS_RETRIES),
+                retry_on_timeout=True,
+                health_check_interval=REDIS_HEALTH_CHECK_INTERVAL,
                 decode_responses=True  # Automatically decode bytes to strings
             )
+            self.client = redis.Redis(connection_pool=self.pool)
+            self._get_and_refresh = self.client.register_script(GET_AND_REFRESH_SCRIPT)
             
             # Test connection
             self.client.ping()
@@ -55,6 +98,18 @@ class RedisManager:
             self.is_connected = False
             return False
     
+    @staticmethod
+    def serialize(data: Dict[str, Any]) -> str:
+        """Encode a state dict for storage in Redis"""
+        return _json_encoder.encode(data)
+    
+    @staticmethod
+    def deserialize(raw: Optional[str]) -> Optional[Dict[str, Any]]:
+        """Decode a value read from Redis (None stays None)"""
+        if raw is None:
+            return None
+        return _json_decoder.decode(raw)
+    
     def set_data(self, key: str, data: Dict[str, Any], ttl: int = 1800) -> bool:
         """
         Store data in Redis with TTL (Time To Live)
@@ -73,7 +128,7 @@ class RedisManager:
         
         try:
             # Convert dict to JSON string
-            json_data = json.dumps(data, default=str)  # default=str handles datetime objects
+            json_data = self.serialize(data)
             
             # Store with TTL
             result = self.client.setex(key, ttl, json_data)
@@ -84,6 +139,33 @@ class RedisManager:
             logger.error(f"Error storing data in Redis: {e}")
             return False
     
+    def set_many(self, items: Dict[str, Any], ttl: int = 1800) -> bool:
+        """
+        Store several values with the same TTL in one pipelined round-trip
+        
+        Args:
+            items: Mapping of Redis key -> value to store as JSON
+            ttl: Expiration time in seconds (default: 30 minutes)
+            
+        Returns:
+            bool: True if every value was stored, False otherwise
+        """
+        pipe = self.pipeline()
+        if pipe is None:
+            logger.warning("Redis not connected, cannot store data")
+            return False
+        
+        try:
+            for key, data in items.items():
+                pipe.setex(key, ttl, self.serialize(data))
+            results = pipe.execute()
+            logger.debug(f"Stored {len(items)} keys in Redis (TTL: {ttl}s)")
+            return all(results)
+            
+        except Exception as e:
+            logger.error(f"Error storing data in Redis: {e}")
+            return False
+    
     def get_data(self, key: str) -> Optional[Dict[str, Any]]:
         """
         Retrieve data from Redis
@@ -106,7 +188,7 @@ class RedisManager:
                 return None
             
             # Convert JSON string back to dict
-            data = json.loads(json_data)
+            data = self.deserialize(json_data)
             logger.debug(f"Retrieved data from Redis: {key}")
             return data
             
@@ -114,6 +196,59 @@ class RedisManager:
             logger.error(f"Error retrieving data from Redis: {e}")
             return None
     
+    def get_many(self, keys: List[str]) -> List[Optional[Dict[str, Any]]]:
+        """
+        Retrieve several values with a single MGET
+        
+        Args:
+            keys: Redis keys to retrieve
+            
+        Returns:
+            List of values in the same order as `keys` (None where missing or on error)
+        """
+        if not self.is_connected:
+            logger.warning("Redis not connected, cannot retrieve data")
+            return [None] * len(keys)
+        if not keys:
+            return []
+        
+        try:
+            return [self.deserialize(json_data) for json_data in self.client.mget(keys)]
+            
+        except Exception as e:
+            logger.error(f"Error retrieving data from Redis: {e}")
+            return [None] * len(keys)
+    
+    def get_data_and_refresh(self, key: str, ttl: int = 1800,
+                             touch: Optional[Dict[str, Any]] = None) -> Optional[Dict[str, Any]]:
+        """
+        Retrieve data and refresh its TTL in a single round-trip (server-side script)
+        
+        Args:
+            key: Redis key to retrieve
+            ttl: New expiration time in seconds
+            touch: Optional extra keys to set (with the same TTL) in the same round-trip -
+                   only written if `key` exists
+            
+        Returns:
+            Dict if found, None if not found or error
+        """
+        if not self.is_connected:
+            logger.warning("Redis not connected, cannot retrieve data")
+            return None
+        
+        try:
+            touch = touch or {}
+            json_data = self._get_and_refresh(
+                keys=[key, *touch],
+                args=[ttl, *(self.serialize(value) for value in touch.values())]
+            )
+            return self.deserialize(json_data)
+            
+        except Exception as e:
+            logger.error(f"Error retrieving data from Redis: {e}")
+            return None
+    
     def delete_data(self, key: str) -> bool:
         """
         Delete data from Redis
@@ -136,6 +271,79 @@ class RedisManager:
             logger.error(f"Error deleting from Redis: {e}")
             return False
     
+    def delete_many(self, *keys: str) -> int:
+        """
+        Delete several keys with a single DEL
+        
+        Args:
+            keys: Redis keys to delete
+            
+        Returns:
+            int: Number of keys that existed and were deleted
+        """
+        if not self.is_connected or not keys:
+            return 0
+        
+        try:
+            result = self.client.delete(*keys)
+            logger.debug(f"Deleted from Redis: {', '.join(keys)}")
+            return result
+            
+        except Exception as e:
+            logger.error(f"Error deleting from Redis: {e}")
+            return 0
+    
+    def exists(self, key: str) -> bool:
+        """
+        Check if a key exists without fetching its value
+        
+        Args:
+            key: Redis key
+            
+        Returns:
+            bool: True if the key exists
+        """
+        if not self.is_connected:
+            return False
+        
+        try:
+            return self.client.exists(key) == 1
+        except Exception as e:
+            logger.error(f"Error checking key in Redis: {e}")
+            return False
+    
+    def expire(self, key: str, ttl: int = 1800) -> bool:
+        """
+        Refresh TTL of a key without touching its value
+        
+        Args:
+            key: Redis key
+            ttl: New expiration time in seconds
+            
+        Returns:
+            bool: True if the key exists and TTL was set
+        """
+        if not self.is_connected:
+            return False
+        
+        try:
+            return bool(self.client.expire(key, ttl))
+        except Exception as e:
+            logger.error(f"Error setting TTL in Redis: {e}")
+            return False
+    
+    def pipeline(self):
+        """
+        Get a non-transactional pipeline to batch several commands in one round-trip
+        
+        Returns:
+            redis Pipeline, or None if not connected
+        """
+        if not self.is_connected:
+            return None
+        
+        return self.client.pipeline(transaction=False)
+    
     def get_ttl(self, key: str) -> int:
         """
         Get remaining TTL for a key
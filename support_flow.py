@@ -1,18 +1,128 @@
 # support_flow.py - Customer support conversation flow
 
 import logging
+import re
 from typing import Dict, Any, Tuple, Optional
 from datetime import datetime
-from conversation_state import ConversationState
+from conversation_state import ConversationState, apply_state_updates
 
 logger = logging.getLogger(__name__)
 
+# Accepted replies (lowercased, stripped) for the issue type step
+ISSUE_TYPE_CHOICES = {
+    **dict.fromkeys(["1", "order", "order issue", "delivery", "tracking"], "order_issue"),
+    **dict.fromkeys(["2", "product", "product question", "features"], "product_question"),
+    **dict.fromkeys(["3", "account", "account problem", "login", "billing"], "account_problem"),
+    **dict.fromkeys(["4", "return", "refund", "return refund"], "return_refund"),
+}
+
+# Free-text fallback for the issue type step: the first of these words found in the
+# reply picks the issue type ("i want a refund please" -> return_refund)
+ISSUE_TYPE_KEYWORDS = {
+    **dict.fromkeys(["order", "delivery", "tracking", "shipment"], "order_issue"),
+    **dict.fromkeys(["product", "feature", "features", "compat", "compatible", "compatibility"], "product_question"),
+    **dict.fromkeys(["account", "login", "billing", "password"], "account_problem"),
+    **dict.fromkeys(["return", "refund", "exchange"], "return_refund"),
+}
+_WORD_RE = re.compile(r"[a-z]+")
+
+# Accepted replies for the confirmation step -> flow outcome
+CONFIRMATION_OUTCOMES = {
+    **dict.fromkeys(["1", "yes", "resolved", "fixed", "good"], "resolved"),
+    **dict.fromkeys(["2", "no", "not resolved", "still need help"], "escalated"),
+}
+
+# Per-issue-type replies. Issue types missing from INFO_PROMPTS (product questions)
+# skip the info gathering step and go straight to the solution
+DETAIL_PROMPTS = {
+    "order_issue": "I'll help you with your order issue. Please tell me:\n• Your order number (if you have it)\n• What specifically is wrong\n• When you placed the order",
+    "product_question": "I'll help answer your product question. Please tell me:\n• Which product you're asking about\n• What you'd like to know",
+    "account_problem": "I'll help with your account issue. Please describe:\n• What problem you're experiencing\n• What you were trying to do",
+    "return_refund": "I'll help you with your return or refund. Please provide:\n• Your order number\n• Which item(s) you want to return\n• Reason for return",
+}
+
+INFO_PROMPTS = {
+    "order_issue": "Thank you for those details. To help you better, can you provide your email address or phone number associated with the order?",
+    "account_problem": "I understand the issue. Can you confirm the email address associated with your account?",
+    "return_refund": "Got it. I'll help process your return. Can you confirm the email address you used for the order?",
+}
+
+SOLUTIONS = {
+    "order_issue": ("Here's how I can help with your order issue:\n\n"
+                    "1. **Check Order Status**: I can look up your order using your email\n"
+                    "2. **Tracking Information**: Most orders ship within 24-48 hours\n"
+                    "3. **Delivery Issues**: If your order is delayed, I can check with our shipping partner\n\n"
+                    "For immediate assistance, you can also track your order at: https://yourstore.com/track"),
+    "product_question": ("I'd be happy to help with product information:\n\n"
+                         "1. **Product Details**: Check our website for full specifications\n"
+                         "2. **Compatibility**: Most of our products work with standard systems\n"
+                         "3. **Warranty**: All products come with 1-year manufacturer warranty\n\n"
+                         "For detailed specs, visit: https://yourstore.com/products"),
+    "account_problem": ("Here are solutions for common account issues:\n\n"
+                        "1. **Password Reset**: Use 'Forgot Password' on the login page\n"
+                        "2. **Account Access**: Clear your browser cache and try again\n"
+                        "3. **Billing Questions**: Check your email for receipt confirmations\n\n"
+                        "Account help: https://yourstore.com/account-help"),
+    "return_refund": ("Here's our return and refund process:\n\n"
+                      "1. **Return Window**: 30 days from purchase date\n"
+                      "2. **Process**: Visit our returns page to start a return\n"
+                      "3. **Refunds**: Processed within 5-7 business days after we receive the item\n\n"
+                      "Start your return: https://yourstore.com/returns"),
+}
+DEFAULT_SOLUTION = "I've noted your issue and our support team will help you resolve it."
+
+# Support flow steps and their logic - static, so shared by every SupportFlow
+FLOW_STEPS = {
+    "1_issue_type": {
+        "prompt": "I'll help you with that! What type of issue are you having?",
+        "options": [
+            "1. Order issue (delivery, tracking, etc.)",
+            "2. Product question (features, compatibility)", 
+            "3. Account problem (login, billing, etc.)",
+            "4. Return or refund request"
+        ],
+        "next_step": "2_collect_details"
+    },
+    "2_collect_details": {
+        "prompt": "Tell me more about your {issue_type}. Please provide details:",
+        "input_type": "text",
+        "next_step": "3_gather_info"
+    },
+    "3_gather_info": {
+        "prompt": "To help you better, I need some information:",
+        "input_type": "text", 
+        "next_step": "4_provide_solution"
+    },
+    "4_provide_solution": {
+        "action": "generate_solution",
+        "next_step": "5_confirmation"
+    },
+    "5_confirmation": {
+        "prompt": "Did this help resolve your issue?",
+        "options": [
+            "1. Yes, issue resolved!",
+            "2. No, I still need help"
+        ],
+        "next_step": "end"
+    }
+}
+
+# Steps are static, so render each prompt (+ numbered options) once up front
+for _step_config in FLOW_STEPS.values():
+    if "prompt" in _step_config:
+        _step_config["rendered"] = _step_config["prompt"]
+        if "options" in _step_config:
+            _step_config["rendered"] += "\n\n" + "".join(f"{option}\n" for option in _step_config["options"])
+
+
 class SupportFlow:
     """
     Handles customer support conversation flow
     Manages multi-step support interactions with state preservation
     """
     
+    __slots__ = ("conv_mgr", "flow_name", "flow_steps", "_step_handlers")
+    
     def __init__(self, conversation_manager: ConversationState):
         """
         Initialize support flow handler
@@ -23,40 +133,16 @@ class SupportFlow:
         self.conv_mgr = conversation_manager
         self.flow_name = "support"
         
-        # Define flow steps and their logic
-        self.flow_steps = {
-            "1_issue_type": {
-                "prompt": "I'll help you with that! What type of issue are you having?",
-                "options": [
-                    "1. Order issue (delivery, tracking, etc.)",
-                    "2. Product question (features, compatibility)", 
-                    "3. Account problem (login, billing, etc.)",
-                    "4. Return or refund request"
-                ],
-                "next_step": "2_collect_details"
-            },
-            "2_collect_details": {
-                "prompt": "Tell me more about your {issue_type}. Please provide details:",
-                "input_type": "text",
-                "next_step": "3_gather_info"
-            },
-            "3_gather_info": {
-                "prompt": "To help you better, I need some information:",
-                "input_type": "text", 
-                "next_step": "4_provide_solution"
-            },
-            "4_provide_solution": {
-                "action": "generate_solution",
-                "next_step": "5_confirmation"
-            },
-            "5_confirmation": {
-                "prompt": "Did this help resolve your issue?",
-                "options": [
-                    "1. Yes, issue resolved!",
-                    "2. No, I still need help"
-                ],
-                "next_step": "end"
-            }
+        # Shared, read-only step definitions
+        self.flow_steps = FLOW_STEPS
+        
+        # Step -> handler, all called as handler(customer_id, message, state)
+        self._step_handlers = {
+            "1_issue_type": self._handle_issue_type_selection,
+            "2_collect_details": self._handle_detail_collection,
+            "3_gather_info": self._handle_info_gathering,
+            "4_provide_solution": self._handle_solution_provision,
+            "5_confirmation": self._handle_confirmation,
         }
     
     def start_support_flow(self, customer_id: str, initial_message: str) -> Tuple[str, Dict[str, Any]]:
@@ -85,16 +171,14 @@ class SupportFlow:
             }
         }
         
-        self.conv_mgr.update_state(customer_id, updates)
+        state = self.conv_mgr.update_and_get(customer_id, updates)
         
         # Generate first response
         step_config = self.flow_steps["1_issue_type"]
         response = self._generate_step_response(step_config)
         
-        # Get updated state
-        state = self.conv_mgr.get_state(customer_id)
-        
-        logger.info(f"Started support flow for customer {customer_id}")
+        if logger.isEnabledFor(logging.INFO):
+            logger.info("Started support flow for customer %s", customer_id)
         
         return response, state
     
@@ -122,21 +206,13 @@ class SupportFlow:
         
         # Process current step
         try:
-            if current_step == "1_issue_type":
-                return self._handle_issue_type_selection(customer_id, message, state)
-            elif current_step == "2_collect_details":
-                return self._handle_detail_collection(customer_id, message, state)
-            elif current_step == "3_gather_info":
-                return self._handle_info_gathering(customer_id, message, state)
-            elif current_step == "4_provide_solution":
-                return self._handle_solution_provision(customer_id, message, state)
-            elif current_step == "5_confirmation":
-                return self._handle_confirmation(customer_id, message, state)
-            else:
+            handler = self._step_handlers.get(current_step)
+            if handler is None:
                 return "I'm not sure what step we're on. Let me help you restart.", {}
+            return handler(customer_id, message, state)
                 
         except Exception as e:
-            logger.error(f"Error processing support message: {e}")
+            logger.error("Error processing support message: %s", e)
             return "I encountered an error. Let me try to help you again. What's your issue?", {}
     
     def _handle_issue_type_selection(self, customer_id: str, message: str, state: Dict) -> Tuple[str, Dict]:
@@ -158,21 +234,11 @@ class SupportFlow:
             "metadata.message_count": state["metadata"]["message_count"] + 1
         }
         
-        self.conv_mgr.update_state(customer_id, updates)
+        updated_state = self.conv_mgr.apply_and_save(customer_id, state, updates)
         
         # Generate response for detail collection
-        if issue_type == "order_issue":
-            response = "I'll help you with your order issue. Please tell me:\n• Your order number (if you have it)\n• What specifically is wrong\n• When you placed the order"
-        elif issue_type == "product_question":
-            response = "I'll help answer your product question. Please tell me:\n• Which product you're asking about\n• What you'd like to know"
-        elif issue_type == "account_problem":
-            response = "I'll help with your account issue. Please describe:\n• What problem you're experiencing\n• What you were trying to do"
-        elif issue_type == "return_refund":
-            response = "I'll help you with your return or refund. Please provide:\n• Your order number\n• Which item(s) you want to return\n• Reason for return"
-        else:
-            response = f"Tell me more about your {issue_type}. Please provide details:"
+        response = DETAIL_PROMPTS.get(issue_type) or f"Tell me more about your {issue_type}. Please provide details:"
         
-        updated_state = self.conv_mgr.get_state(customer_id)
         return response, updated_state
     
     def _handle_detail_collection(self, customer_id: str, message: str, state: Dict) -> Tuple[str, Dict]:
@@ -185,31 +251,18 @@ class SupportFlow:
             "metadata.message_count": state["metadata"]["message_count"] + 1
         }
         
-        self.conv_mgr.update_state(customer_id, updates)
-        
         # Determine what additional info we need based on issue type
         issue_type = state["collected_data"].get("issue_type", "")
+        response = INFO_PROMPTS.get(issue_type)
         
-        if issue_type == "order_issue":
-            response = "Thank you for those details. To help you better, can you provide your email address or phone number associated with the order?"
-        elif issue_type == "product_question":
-            response = "Thanks for the details. Let me look up information about that product for you."
-            # Skip info gathering for product questions
+        if response is None:
+            # Nothing more to ask (e.g. product questions) - move to solution step. The
+            # solution step saves right away, so apply these updates locally and write once
             updates["current_step"] = "4_provide_solution"
-            self.conv_mgr.update_state(customer_id, updates)
-            return self._handle_solution_provision(customer_id, message, self.conv_mgr.get_state(customer_id))
-        elif issue_type == "account_problem":
-            response = "I understand the issue. Can you confirm the email address associated with your account?"
-        elif issue_type == "return_refund":
-            response = "Got it. I'll help process your return. Can you confirm the email address you used for the order?"
-        else:
-            response = "Thank you for the information. Let me see how I can help you."
-            # Move to solution step
-            updates["current_step"] = "4_provide_solution"
-            self.conv_mgr.update_state(customer_id, updates)
-            return self._handle_solution_provision(customer_id, message, self.conv_mgr.get_state(customer_id))
+            apply_state_updates(state, updates)
+            return self._handle_solution_provision(customer_id, message, state)
         
-        updated_state = self.conv_mgr.get_state(customer_id)
+        updated_state = self.conv_mgr.apply_and_save(customer_id, state, updates)
         return response, updated_state
     
     def _handle_info_gathering(self, customer_id: str, message: str, state: Dict) -> Tuple[str, Dict]:
@@ -222,11 +275,9 @@ class SupportFlow:
             "metadata.message_count": state["metadata"]["message_count"] + 1
         }
         
-        self.conv_mgr.update_state(customer_id, updates)
-        
-        # Move to solution provision
-        updated_state = self.conv_mgr.get_state(customer_id)
-        return self._handle_solution_provision(customer_id, message, updated_state)
+        # Move to solution provision, which saves these updates along with its own
+        apply_state_updates(state, updates)
+        return self._handle_solution_provision(customer_id, message, state)
     
     def _handle_solution_provision(self, customer_id: str, message: str, state: Dict) -> Tuple[str, Dict]:
         """Handle solution provision step"""
@@ -244,28 +295,25 @@ class SupportFlow:
             "metadata.message_count": state["metadata"]["message_count"] + 1
         }
         
-        self.conv_mgr.update_state(customer_id, updates)
+        updated_state = self.conv_mgr.apply_and_save(customer_id, state, updates)
         
         # Format response with solution + confirmation prompt
-        response = f"{solution}\n\n" + self.flow_steps["5_confirmation"]["prompt"] + "\n\n"
-        for option in self.flow_steps["5_confirmation"]["options"]:
-            response += f"{option}\n"
+        response = f"{solution}\n\n" + self.flow_steps["5_confirmation"]["rendered"]
         
-        updated_state = self.conv_mgr.get_state(customer_id)
         return response, updated_state
     
     def _handle_confirmation(self, customer_id: str, message: str, state: Dict) -> Tuple[str, Dict]:
         """Handle final confirmation step"""
         
-        message_lower = message.lower().strip()
+        # Menu digits need no lowercasing - try the reply as typed first
+        reply = message.strip()
+        outcome = CONFIRMATION_OUTCOMES.get(reply) or CONFIRMATION_OUTCOMES.get(reply.lower())
         
-        if message_lower in ["1", "yes", "resolved", "fixed", "good"]:
+        if outcome == "resolved":
             # Issue resolved
-            outcome = "resolved"
             response = "Great! I'm glad I could help resolve your issue. 😊\n\nIs there anything else I can help you with today?"
-        elif message_lower in ["2", "no", "not resolved", "still need help"]:
+        elif outcome == "escalated":
             # Issue not resolved - escalate
-            outcome = "escalated"
             response = "I understand you still need help. Let me connect you with a human support agent who can assist you further.\n\nYour case has been escalated and someone will contact you within 24 hours."
         else:
             # Invalid response - ask for clarification
@@ -276,7 +324,8 @@ class SupportFlow:
         self.conv_mgr.complete_flow(customer_id, outcome)
         
         # Log completion
-        logger.info(f"Support flow completed for customer {customer_id} with outcome: {outcome}")
+        if logger.isEnabledFor(logging.INFO):
+            logger.info("Support flow completed for customer %s with outcome: %s", customer_id, outcome)
         
         # Clear state since flow is complete
         final_state = self.conv_mgr.get_state(customer_id) or {}
@@ -285,63 +334,32 @@ class SupportFlow:
     
     def _parse_issue_type(self, message: str) -> Optional[str]:
         """Parse user's issue type selection"""
-        message_lower = message.lower().strip()
-        
-        if message_lower in ["1", "order", "order issue", "delivery", "tracking"]:
-            return "order_issue"
-        elif message_lower in ["2", "product", "product question", "features"]:
-            return "product_question"
-        elif message_lower in ["3", "account", "account problem", "login", "billing"]:
-            return "account_problem"
-        elif message_lower in ["4", "return", "refund", "return refund"]:
-            return "return_refund"
-        else:
-            return None
+        # Menu digits need no lowercasing - try the reply as typed first
+        reply = message.strip()
+        issue_type = ISSUE_TYPE_CHOICES.get(reply)
+        if issue_type:
+            return issue_type
+        
+        message_lower = reply.lower()
+        issue_type = ISSUE_TYPE_CHOICES.get(message_lower)
+        if issue_type:
+            return issue_type
+        
+        # Not one of the exact replies - scan the words once for a keyword
+        for word in _WORD_RE.findall(message_lower):
+            issue_type = ISSUE_TYPE_KEYWORDS.get(word)
+            if issue_type:
+                return issue_type
+        
+        return None
     
     def _generate_step_response(self, step_config: Dict) -> str:
-        """Generate response for a flow step"""
-        response = step_config["prompt"]
-        
-        if "options" in step_config:
-            response += "\n\n"
-            for option in step_config["options"]:
-                response += f"{option}\n"
-        
-        return response
+        """Generate response for a flow step (pre-rendered in __init__)"""
+        return step_config["rendered"]
     
     def _generate_solution(self, issue_type: str, collected_data: Dict) -> str:
         """Generate solution based on issue type and collected data"""
-        
-        if issue_type == "order_issue":
-            return ("Here's how I can help with your order issue:\n\n"
-                   "1. **Check Order Status**: I can look up your order using your email\n"
-                   "2. **Tracking Information**: Most orders ship within 24-48 hours\n"
-                   "3. **Delivery Issues**: If your order is delayed, I can check with our shipping partner\n\n"
-                   "For immediate assistance, you can also track your order at: https://yourstore.com/track")
-        
-        elif issue_type == "product_question":
-            return ("I'd be happy to help with product information:\n\n"
-                   "1. **Product Details**: Check our website for full specifications\n"
-                   "2. **Compatibility**: Most of our products work with standard systems\n"
-                   "3. **Warranty**: All products come with 1-year manufacturer warranty\n\n"
-                   "For detailed specs, visit: https://yourstore.com/products")
-        
-        elif issue_type == "account_problem":
-            return ("Here are solutions for common account issues:\n\n"
-                   "1. **Password Reset**: Use 'Forgot Password' on the login page\n"
-                   "2. **Account Access**: Clear your browser cache and try again\n"
-                   "3. **Billing Questions**: Check your email for receipt confirmations\n\n"
-                   "Account help: https://yourstore.com/account-help")
-        
-        elif issue_type == "return_refund":
-            return ("Here's our return and refund process:\n\n"
-                   "1. **Return Window**: 30 days from purchase date\n"
-                   "2. **Process**: Visit our returns page to start a return\n"
-                   "3. **Refunds**: Processed within 5-7 business days after we receive the item\n\n"
-                   "Start your return: https://yourstore.com/returns")
-        
-        else:
-            return "I've noted your issue and our support team will help you resolve it."
+        return SOLUTIONS.get(issue_type, DEFAULT_SOLUTION)
 
 # Test function for support flow
 def test_support_flow():
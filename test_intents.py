@@ -0,0 +1,82 @@
+import unittest
+
+from intents import detect_intent
+
+
+def baseline_intent(text):
+    """The original generate_response if/elif substring checks, for comparison"""
+    if any(word in text for word in ["hi", "hello", "hey", "menu", "start", "help"]):
+        return "greeting"
+    elif any(word in text for word in ["order", "status", "track", "shipping"]):
+        return "orders"
+    elif any(word in text for word in ["product", "catalog", "buy", "shop", "price"]):
+        return "products"
+    elif any(word in text for word in ["account", "profile", "info", "details"]):
+        return "account"
+    elif any(word in text for word in ["return", "refund", "exchange", "cancel"]):
+        return "returns"
+    elif any(word in text for word in ["thank", "thanks", "appreciate"]):
+        return "thanks"
+    return None
+
+
+class TestKeywordInflections(unittest.TestCase):
+    """Inflected keywords still map to the intent the substring checks gave them"""
+
+    PHRASES = [
+        "i want more information",
+        "can you send my account details",
+        "i returned it last week",
+        "was my payment refunded",
+        "my order got cancelled",
+        "cancellation please",
+        "do you do exchanges",
+        "i thanked you already",
+        "it's tracked now",
+        "where are my orders",
+        "are you buying back items",
+        "what are your prices",
+        "show me products",
+        "thankyou so much",
+    ]
+
+    def test_matches_baseline(self):
+        for phrase in self.PHRASES:
+            with self.subTest(phrase=phrase):
+                self.assertIsNotNone(detect_intent(phrase))
+                self.assertEqual(detect_intent(phrase), baseline_intent(phrase))
+
+    def test_detail_singular(self):
+        self.assertEqual(detect_intent("need a detail about my profile"), "account")
+
+    def test_short_keywords_need_whole_words(self):
+        self.assertEqual(detect_intent("hi"), "greeting")
+        self.assertIsNone(detect_intent("his history"))
+
+    def test_no_keyword(self):
+        self.assertIsNone(detect_intent("ok cool"))
+
+
+class TestIntentPrecedence(unittest.TestCase):
+    """With several intents in one message, the old if/elif order still decides"""
+
+    PHRASES = [
+        ("hi, where is my order", "greeting"),
+        ("hello i want a refund for my order", "greeting"),
+        ("track my order and show the catalog", "orders"),
+        ("refund the order please", "orders"),
+        ("what's the price, thanks", "products"),
+        ("update my account, i want to return it", "account"),
+        ("thanks, cancel it", "returns"),
+        ("thank you, appreciate it", "thanks"),
+    ]
+
+    def test_matches_baseline(self):
+        for phrase, intent in self.PHRASES:
+            with self.subTest(phrase=phrase):
+                self.assertEqual(detect_intent(phrase), intent)
+                self.assertEqual(baseline_intent(phrase), intent)
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -1,11 +1,14 @@
+from collections import deque
 from fastapi import FastAPI, HTTPException
-from pydantic import BaseModel
+from pydantic import BaseModel, ConfigDict
 from typing import Optional,List
 from datetime import datetime
 
 app = FastAPI(title = "Ecomomerce Automationn API", version = "1.0.0")
 
 class WebhookMessage(BaseModel):
+    model_config = ConfigDict(extra='ignore', frozen=True)
+
     message_id:str
     from_phone:str
     message_text:str
@@ -16,6 +19,8 @@ class ShopifyOrder(BaseModel):
     """
     This defines what a Shopify order webhook should look like
     """
+    model_config = ConfigDict(extra='ignore', frozen=True)
+
     order_id: str
     customer_email: str
     total_price: float
@@ -23,8 +28,10 @@ class ShopifyOrder(BaseModel):
     items: List[dict]        # List of items in the order
     created_at: str
 
-received_messages = []
-received_orders = []
+# In-memory history is capped so a long-running process can't grow without bound
+MAX_RECEIVED = 10000
+received_messages = deque(maxlen=MAX_RECEIVED)
+received_orders = deque(maxlen=MAX_RECEIVED)
 
 
 @app.get("/")
@@ -3,11 +3,17 @@ Real WhatsApp Business API Integration using Twilio
 """
 
 import os
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from functools import lru_cache
+from requests.adapters import HTTPAdapter
+from twilio.http.http_client import TwilioHttpClient
 from twilio.rest import Client
-from twilio.twiml.messaging_response import MessagingResponse
 import logging
 from datetime import datetime
 from typing import Optional, Dict, Any, List
+from xml.sax.saxutils import escape
 
 # Load environment variables
 from dotenv import load_dotenv
@@ -15,6 +21,65 @@ load_dotenv()
 
 logger = logging.getLogger(__name__)
 
+# Bulk sends: Twilio has no multi-recipient WhatsApp endpoint, so a batch is
+# fanned out over a small thread pool sharing one client (connection pool)
+BATCH_SIZE = 500
+SEND_WORKERS = 16
+MAX_SENDS_PER_SECOND = 50
+SEND_TIMEOUT_SECONDS = 10
+
+# Single-message TwiML reply - the shape never changes, only the (escaped) body does
+TWIML_MESSAGE_TEMPLATE = '<?xml version="1.0" encoding="UTF-8"?><Response><Message>{}</Message></Response>'
+
+
+@lru_cache(maxsize=8192)
+def format_whatsapp_number(phone: str) -> str:
+    """
+    Add Twilio's "whatsapp:" address prefix if missing - cached, since broadcasts and
+    replies keep hitting the same recipients
+    """
+    return phone if phone.startswith('whatsapp:') else f"whatsapp:{phone}"
+
+
+@lru_cache(maxsize=256)
+def render_menu_text(title: str, items: tuple) -> str:
+    """
+    Render a numbered menu body from (title, description) pairs - cached, since the
+    same few menus are sent over and over
+    """
+    lines = "".join(f"{i}. {item_title}\n   {description}\n\n" for i, (item_title, description) in enumerate(items, 1))
+    return f"*{title}*\n\n{lines}Reply with the number of your choice."
+
+
+@lru_cache(maxsize=256)
+def render_button_text(titles: tuple) -> str:
+    """
+    Render the numbered button options appended to an interactive message - cached
+    like the menus, since the same button sets are reused
+    """
+    options = "\n".join(f"{i}. {title}" for i, title in enumerate(titles, 1))
+    return f"\n\n{options}\n\nReply with the number of your choice."
+
+
+class RateLimiter:
+    """
+    Simple thread-safe limiter that spaces calls at most `rate` per second
+    """
+    
+    def __init__(self, rate: float):
+        self.interval = 1.0 / rate
+        self.next_slot = 0.0
+        self.lock = threading.Lock()
+    
+    def acquire(self):
+        with self.lock:
+            now = time.monotonic()
+            wait = self.next_slot - now
+            self.next_slot = max(now, self.next_slot) + self.interval
+        if wait > 0:
+            time.sleep(wait)
+
+
 class WhatsAppService:
     """
     Handles sending and receiving WhatsApp messages via Twilio
@@ -29,8 +94,12 @@ class WhatsAppService:
         if not all([self.account_sid, self.auth_token, self.whatsapp_number]):
             raise ValueError("Missing Twilio credentials in environment variables")
         
-        # Initialize Twilio client
-        self.client = Client(self.account_sid, self.auth_token)
+        # Initialize Twilio client on one keep-alive session; the pool is sized to the
+        # send workers so batch sends don't drop connections and redo the TLS handshake
+        http_client = TwilioHttpClient(pool_connections=True, timeout=SEND_TIMEOUT_SECONDS)
+        http_client.session.mount("https://", HTTPAdapter(pool_maxsize=SEND_WORKERS))
+        self.client = Client(self.account_sid, self.auth_token, http_client=http_client)
+        self.rate_limiter = RateLimiter(MAX_SENDS_PER_SECOND)
         
         logger.info("✅ WhatsApp service initialized")
     
@@ -47,8 +116,7 @@ class WhatsAppService:
         """
         try:
             # Format phone number for WhatsApp
-            if not to_phone.startswith('whatsapp:'):
-                to_phone = f"whatsapp:{to_phone}"
+            to_phone = format_whatsapp_number(to_phone)
             
             # Send message via Twilio
             message_obj = self.client.messages.create(
@@ -77,6 +145,31 @@ class WhatsAppService:
                 "content": message
             }
     
+    def send_batch(self, messages: List[Dict[str, str]]) -> List[Dict[str, Any]]:
+        """
+        Send a batch of WhatsApp messages (up to BATCH_SIZE)
+        
+        Args:
+            messages: List of {"to": phone, "body": text}
+            
+        Returns:
+            List of send_message results, in the same order as `messages`
+        """
+        if len(messages) > BATCH_SIZE:
+            raise ValueError(f"Batch too large: {len(messages)} > {BATCH_SIZE}")
+        
+        def send(item):
+            self.rate_limiter.acquire()
+            return self.send_message(item["to"], item["body"])
+        
+        with ThreadPoolExecutor(max_workers=SEND_WORKERS) as executor:
+            results = list(executor.map(send, messages))
+        
+        sent = sum(1 for result in results if result['status'] == 'sent')
+        logger.info(f"📦 Batch sent: {sent}/{len(messages)} delivered")
+        
+        return results
+    
     def process_incoming_webhook(self, webhook_data: Dict[str, Any]) -> Dict[str, Any]:
         """
         Process incoming WhatsApp webhook from Twilio
@@ -117,9 +210,7 @@ class WhatsAppService:
         by returning TwiML (Twilio Markup Language)
         """
         try:
-            response = MessagingResponse()
-            response.message(reply_message)
-            return str(response)
+            return TWIML_MESSAGE_TEMPLATE.format(escape(reply_message))
             
         except Exception as e:
             logger.error(f"❌ Failed to generate webhook response: {e}")
@@ -135,12 +226,10 @@ class WhatsAppService:
         ]
         """
         try:
-            if not to_phone.startswith('whatsapp:'):
-                to_phone = f"whatsapp:{to_phone}"
+            to_phone = format_whatsapp_number(to_phone)
             
             # For Twilio sandbox, we'll simulate buttons with numbered options
-            button_text = "\n\n" + "\n".join([f"{i+1}. {btn['title']}" for i, btn in enumerate(buttons)])
-            full_message = message + button_text + "\n\nReply with the number of your choice."
+            full_message = message + render_button_text(tuple(btn['title'] for btn in buttons))
             
             message_obj = self.client.messages.create(
                 body=full_message,
@@ -172,14 +261,9 @@ class WhatsAppService:
         ]
         """
         try:
-            if not to_phone.startswith('whatsapp:'):
-                to_phone = f"whatsapp:{to_phone}"
+            to_phone = format_whatsapp_number(to_phone)
             
-            menu_text = f"*{title}*\n\n"
-            for i, item in enumerate(menu_items):
-                menu_text += f"{i+1}. {item['title']}\n   {item['description']}\n\n"
-            
-            menu_text += "Reply with the number of your choice."
+            menu_text = render_menu_text(title, tuple((item['title'], item['description']) for item in menu_items))
             
             message_obj = self.client.messages.create(
                 body=menu_text,
@@ -204,15 +288,16 @@ class WhatsAppService:
         """
         results = {"successful": [], "failed": []}
         
-        for phone in phone_list:
-            try:
-                result = self.send_message(phone, message)
+        # Fan out through the rate-limited send pool, one batch at a time
+        for start in range(0, len(phone_list), BATCH_SIZE):
+            batch = phone_list[start:start + BATCH_SIZE]
+            batch_results = self.send_batch([{"to": phone, "body": message} for phone in batch])
+            
+            for phone, result in zip(batch, batch_results):
                 if result['status'] == 'sent':
                     results["successful"].append(phone)
                 else:
                     results["failed"].append({"phone": phone, "error": result.get('error')})
-            except Exception as e:
-                results["failed"].append({"phone": phone, "error": str(e)})
         
         logger.info(f"📡 Broadcast sent: {len(results['successful'])} successful, {len(results['failed'])} failed")
         